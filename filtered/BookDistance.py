@@ -1,13 +1,58 @@
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import MinMaxScaler
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from scipy.spatial.distance import cdist, pdist, squareform
+
+
+def top_k_indices(scores, k):
+    """
+    Индексы k наибольших оценок по убыванию без полной сортировки массива.
+    При равных оценках раньше идет меньший индекс (как при стабильной сортировке)
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=int)
+    
+    # Порог k-й оценки; все книги с оценкой не ниже порога - кандидаты
+    threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+    candidates = np.flatnonzero(scores >= threshold)
+    order = np.argsort(-scores[candidates], kind='stable')
+    return candidates[order[:k]]
+
 
 class BookDistanceMetrics:
+    # Веса компонент композитного расстояния по умолчанию
+    DEFAULT_WEIGHTS = {
+        'genre': 0.35,
+        'has_illustrations': 0.15,
+        'author': 0.2,
+        'publisher': 0.05,
+        'language': 0.05,
+        'numerical': 0.2
+    }
+    # Начиная с этого размера каталога матрица расстояний считается
+    # блоками строк в нескольких потоках (cdist отпускает GIL)
+    PARALLEL_MIN_BOOKS = 2000
+    # Сколько матриц схожести для нестандартных весов держать в кэше
+    WEIGHTED_CACHE_SIZE = 8
+    # Сколько последних результатов каждого вычисления cached_result хранить на экземпляре
+    RESULT_CACHE_SIZE = 32
+    # Блок строк при сравнении категориальных кодов: временная маска не больше BLOCK_ROWS x n
+    BLOCK_ROWS = 4096
+
     def __init__(self, df):
         self.df = df
+        self.numerical_features = ['year', 'pages']
         self._setup_taxonomy_tree()
         self._setup_scalers()
-        self.numerical_features = ['year', 'pages']
+        self._setup_numerical_matrix()
+        self._setup_categorical_codes()
+        self._setup_column_arrays()
+        self._weighted_similarity = {}
+        self._result_cache = {}
     
     def _setup_taxonomy_tree(self):
         """Иерархия жанров в виде дерева"""
@@ -57,22 +102,123 @@ class BookDistanceMetrics:
             'приключения': 'художественная.проза.приключения',
             'сатира': 'художественная.проза.сатира'
         }
+
+        # Таблица таксономических расстояний между жанрами дерева.
+        # Последняя строка/столбец соответствует жанрам вне дерева (id = -1)
+        genres = list(self.genre_mapping)
+        self.genre_id = {genre: i for i, genre in enumerate(genres)}
+        self.genre_dist_table = np.ones((len(genres) + 1, len(genres) + 1))
+        self._encode_taxonomy_nodes()
+        self.genre_dist_table[:-1, :-1] = self._taxonomic_distance_table(genres)
+        self.genre_ids = self.df['genre'].map(self.genre_id).fillna(-1).astype(np.int32).values
     
-    def _setup_scalers(self):
-        """Инициализация нормализаторов для числовых признаков"""
-        self.scalers = {}
+    def _encode_taxonomy_nodes(self):
+        """Уникальный целочисленный id для каждого узла дерева жанров (ключ - путь узла)"""
+        self.node_ids = {}
+        
+        def walk(subtree, prefix):
+            for name, children in subtree.items():
+                path = f"{prefix}.{name}" if prefix else name
+                self.node_ids[path] = len(self.node_ids)
+                walk(children, path)
         
-        # Год публикации (чем новее, тем лучше)
-        years = self.df['year'].values.reshape(-1, 1)
-        self.scalers['year'] = MinMaxScaler().fit(years)
+        walk(self.genre_hierarchy, '')
+    
+    def _path_node_ids(self, path, depth):
+        """Путь жанра как массив id узлов от корня, дополненный -1 до длины depth"""
+        ids = np.full(depth, -1, dtype=np.int16)
+        if path:
+            parts = path.split('.')
+            for level in range(len(parts)):
+                prefix = '.'.join(parts[:level + 1])
+                ids[level] = self.node_ids.setdefault(prefix, len(self.node_ids))
+        return ids
+    
+    def _taxonomic_distance_table(self, genres, max_depth=4):
+        """
+        Таксономические расстояния между всеми парами жанров (K x K).
+        Уровень общего предка - длина совпадающего префикса путей из id узлов
+        """
+        paths = [self._get_genre_path(genre) for genre in genres]
+        depth = max([path.count('.') + 1 for path in paths if path], default=1)
+        node_paths = np.array([self._path_node_ids(path, depth) for path in paths]).reshape(len(paths), depth)
+        depths = (node_paths >= 0).sum(axis=1)
+        
+        same = (node_paths[:, None, :] == node_paths[None, :, :]) & (node_paths[:, None, :] >= 0)
+        common_level = same.cumprod(axis=2).sum(axis=2)
         
-        # Возрастное ограничение
-        age = self.df['age_restriction'].values.reshape(-1, 1)
-        self.scalers['age_restriction'] = MinMaxScaler().fit(age)
+        # Формула таксономического расстояния
+        table = np.minimum((depths[:, None] + depths[None, :] - 2 * common_level) / (2 * max_depth), 1.0)
         
-        # Количество страниц
-        pages = self.df['pages'].values.reshape(-1, 1)
-        self.scalers['pages'] = MinMaxScaler().fit(pages)
+        # Жанры без пути в дереве максимально далеки от всех
+        unknown = depths == 0
+        table[unknown, :] = 1.0
+        table[:, unknown] = 1.0
+        return table
+    
+    def _setup_scalers(self):
+        """Параметры min-max нормализации числовых признаков"""
+        self.feat_min = {}
+        self.feat_range = {}
+        
+        # Год публикации, возрастное ограничение, количество страниц
+        for feature in ('year', 'age_restriction', 'pages'):
+            values = self.df[feature].values
+            self.feat_min[feature] = values.min()
+            # Для постоянного признака все нормализованные значения равны 0
+            self.feat_range[feature] = (values.max() - values.min()) or 1.0
+    
+    def _setup_numerical_matrix(self):
+        """Нормализованные числовые признаки всех книг (n x len(numerical_features))"""
+        features = self.numerical_features
+        # x * scale + offset - та же формула и порядок операций, что у MinMaxScaler.transform
+        scales = 1.0 / np.array([self.feat_range[f] for f in features], dtype=float)
+        offsets = -np.array([self.feat_min[f] for f in features], dtype=float) * scales
+        self._num_matrix = self.df[features].values * scales + offsets
+    
+    def _setup_categorical_codes(self):
+        """Целочисленные коды категориальных и бинарных признаков"""
+        self._cat = {
+            feature: pd.factorize(self.df[feature])[0].astype(np.int32)
+            for feature in ('author', 'publisher', 'language', 'has_illustrations')
+        }
+        # Коды для расстояний: каждый пропуск (код -1) получает собственный код,
+        # поэтому пропущенное значение не совпадает ни с чем, в том числе с другим пропуском
+        self._distance_codes = {
+            feature: self._unique_missing_codes(codes)
+            for feature, codes in self._cat.items()
+        }
+        # Коды самих жанров (в отличие от genre_ids различают и жанры вне дерева)
+        self.genre_codes = pd.factorize(self.df['genre'])[0].astype(np.int32)
+        # Инвертированные индексы: код жанра/автора -> позиции его книг
+        self.genre_index = self._positions_by_code(self.genre_codes)
+        self.author_index = self._positions_by_code(self._cat['author'])
+    
+    @staticmethod
+    def _unique_missing_codes(codes):
+        """Копия кодов, в которой каждый код -1 заменен новым, не встречающимся больше нигде"""
+        missing = codes < 0
+        if not missing.any():
+            return codes
+        codes = codes.copy()
+        codes[missing] = codes.max() + 1 + np.arange(missing.sum(), dtype=codes.dtype)
+        return codes
+    
+    @staticmethod
+    def _positions_by_code(codes):
+        """Позиции книг для каждого кода: список массивов, номер в списке - код (код -1 пропускается)"""
+        counts = np.bincount(codes[codes >= 0], minlength=codes.max(initial=-1) + 1)
+        # Стабильная сортировка: внутри кода позиции идут по возрастанию, книги с кодом -1 - в начале
+        order = np.argsort(codes, kind='stable')[len(codes) - counts.sum():]
+        return np.split(order, np.cumsum(counts)[:-1])
+    
+    def _setup_column_arrays(self):
+        """Столбцы датасета в виде массивов NumPy для быстрого доступа по индексу"""
+        self._col = {
+            column: self.df[column].values
+            for column in ('title', 'author', 'genre', 'publisher', 'language',
+                           'has_illustrations', 'year', 'pages')
+        }
     
     def _get_genre_path(self, genre):
         """Получить путь жанра в дереве"""
@@ -117,21 +263,12 @@ class BookDistanceMetrics:
         return min(distance, 1.0)
     
     def get_numerical_vector(self, book_idx):
-        """Получает вектор числовых признаков для книги"""
-        book = self.df.iloc[book_idx]
-        vector = []
-
-        for feature in self.numerical_features:
-            value = self.scalers[feature].transform([[book[feature]]])[0][0]
-            vector.append(value)
-
-        return np.array(vector)
+        """Получает вектор числовых признаков для книги (для массива индексов - матрицу)"""
+        return self._num_matrix[book_idx]
     
     # Метрика 2: Манхэттенское расстояние
     def manhattan_distance(self, i, j):
-        vec1 = self.get_numerical_vector(i)
-        vec2 = self.get_numerical_vector(j)
-        return np.sum(np.abs(vec1 - vec2))
+        return np.abs(self._num_matrix[i] - self._num_matrix[j]).sum()
     
     def categorical_distance(self, val1, val2):
         """
@@ -152,22 +289,12 @@ class BookDistanceMetrics:
         Композитное расстояние между двумя книгами
         """
         if weights is None:
-            weights = {
-                'genre': 0.35,
-                'has_illustrations': 0.15,
-                'author': 0.2,
-                'publisher': 0.05,
-                'language': 0.05,
-                'numerical': 0.2
-            }
+            weights = self.DEFAULT_WEIGHTS
 
-        book1 = self.df.iloc[book1_idx]
-        book2 = self.df.iloc[book2_idx]
-        
         total_distance = 0.0
         
         # Таксономическое расстояние по жанру
-        genre_dist = self.taxonomic_distance(book1['genre'], book2['genre'])
+        genre_dist = self.genre_dist_table[self.genre_ids[book1_idx], self.genre_ids[book2_idx]]
         total_distance += weights['genre'] * genre_dist
         
         # Числовые признаки
@@ -175,40 +302,194 @@ class BookDistanceMetrics:
         total_distance += weights['numerical'] * numerical_dist
         
         # Категориальные признаки
-        author_dist = self.categorical_distance(book1['author'], book2['author'])
+        author = self._distance_codes['author']
+        author_dist = self.categorical_distance(author[book1_idx], author[book2_idx])
         total_distance += weights['author'] * author_dist
         
-        publisher_dist = self.categorical_distance(book1['publisher'], book2['publisher'])
+        publisher = self._distance_codes['publisher']
+        publisher_dist = self.categorical_distance(publisher[book1_idx], publisher[book2_idx])
         total_distance += weights['publisher'] * publisher_dist
         
-        language_dist = self.categorical_distance(book1['language'], book2['language'])
+        language = self._distance_codes['language']
+        language_dist = self.categorical_distance(language[book1_idx], language[book2_idx])
         total_distance += weights['language'] * language_dist
 
         # Бинарные признаки
-        ill_dist = self.bin_distance(book1['has_illustrations'], book2['has_illustrations'])
+        illustrations = self._distance_codes['has_illustrations']
+        ill_dist = self.bin_distance(illustrations[book1_idx], illustrations[book2_idx])
         total_distance += weights['has_illustrations'] * ill_dist
 
         return total_distance
     
+    def distance_row(self, book_idx, weights=None):
+        """
+        Композитные расстояния от одной книги до всех книг (вектор длины n)
+        """
+        if weights is None:
+            weights = self.DEFAULT_WEIGHTS
+
+        gid = self.genre_ids
+        row = weights['genre'] * self.genre_dist_table[gid[book_idx], gid]
+        row += weights['numerical'] * np.abs(self._num_matrix - self._num_matrix[book_idx]).sum(axis=1)
+        for feature, codes in self._distance_codes.items():
+            row += weights[feature] * (codes != codes[book_idx])
+
+        return row
+    
+    def pairwise_matrix(self, weights=None):
+        """
+        Матрица композитных расстояний между всеми книгами (n x n).
+        Числовые признаки - одно манхэттенское расстояние (pdist, только верхний треугольник),
+        категориальные добавляются сравнением кодов
+        """
+        if weights is None:
+            weights = self.DEFAULT_WEIGHTS
+
+        features = self._weighted_features(weights)
+
+        n_workers = os.cpu_count() or 1
+        if n_workers > 1 and len(features) >= self.PARALLEL_MIN_BOOKS:
+            distance_matrix = self._parallel_cityblock(features, n_workers)
+        else:
+            distance_matrix = squareform(pdist(features, 'cityblock').astype(np.float32))
+
+        # Таксономическое расстояние по жанру
+        gid = self.genre_ids
+        distance_matrix += self._weighted_genre_table(weights)[gid[:, None], gid[None, :]]
+
+        books = np.arange(len(features))
+        self._add_categorical_distances(distance_matrix, books, books, weights)
+
+        # Расстояние книги до самой себя всегда 0 (в т.ч. для жанров вне дерева)
+        np.fill_diagonal(distance_matrix, 0.0)
+        return distance_matrix
+    
+    def distance_block(self, rows, columns, weights=None):
+        """
+        Композитные расстояния между книгами rows и columns (len(rows) x len(columns)).
+        Считает только нужный блок (cdist), не строя полную матрицу n x n
+        """
+        if weights is None:
+            weights = self.DEFAULT_WEIGHTS
+        rows = np.asarray(rows, dtype=np.intp)
+        columns = np.asarray(columns, dtype=np.intp)
+
+        features = self._weighted_features(weights)
+        distance_block = cdist(features[rows], features[columns], 'cityblock').astype(np.float32)
+
+        gid = self.genre_ids
+        distance_block += self._weighted_genre_table(weights)[gid[rows][:, None], gid[columns][None, :]]
+
+        self._add_categorical_distances(distance_block, rows, columns, weights)
+
+        # Расстояние книги до самой себя всегда 0
+        distance_block[rows[:, None] == columns[None, :]] = 0.0
+        return distance_block
+    
+    def _weighted_features(self, weights):
+        """Взвешенная матрица числовых признаков: манхэттенское расстояние по ней - числовая компонента"""
+        return weights['numerical'] * self._num_matrix
+    
+    def _weighted_genre_table(self, weights):
+        """Взвешенная таблица жанровых расстояний в float32 - для матриц, чтобы не создавать n x n во float64"""
+        return (weights['genre'] * self.genre_dist_table).astype(np.float32)
+    
+    def _add_categorical_distances(self, distance_block, rows, columns, weights):
+        """
+        Прибавляет к distance_block (rows x columns) взвешенные расстояния категориальных признаков.
+        Коды сравниваются блоками по BLOCK_ROWS строк, чтобы временная маска не росла до n x n
+        """
+        for feature, codes in self._distance_codes.items():
+            weight = np.float32(weights[feature])
+            if not weight:
+                continue
+            column_codes = codes[columns]
+            for start in range(0, len(rows), self.BLOCK_ROWS):
+                stop = start + self.BLOCK_ROWS
+                mismatch = codes[rows[start:stop], None] != column_codes[None, :]
+                distance_block[start:stop] += weight * mismatch
+    
+    @staticmethod
+    def _parallel_cityblock(features, n_workers):
+        """Манхэттенские расстояния между всеми строками, блоками строк в пуле потоков"""
+        n = len(features)
+        distance_matrix = np.empty((n, n), dtype=np.float32)
+        bounds = np.linspace(0, n, 4 * n_workers + 1, dtype=int)
+
+        def fill_rows(start, stop):
+            distance_matrix[start:stop] = cdist(features[start:stop], features, 'cityblock')
+
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            list(pool.map(fill_rows, bounds[:-1], bounds[1:]))
+        return distance_matrix
+    
+    @cached_property
+    def S(self):
+        """
+        Матрица схожести всех пар книг (1 - distance) для весов по умолчанию.
+        Считается при первом обращении и переиспользуется всеми запросами
+        """
+        return 1.0 - self.pairwise_matrix()
+    
+    def weights_key(self, weights=None):
+        """Кортеж весов в порядке DEFAULT_WEIGHTS (недостающие веса берутся по умолчанию)"""
+        if weights is None:
+            weights = {}
+        return tuple(weights.get(name, default) for name, default in self.DEFAULT_WEIGHTS.items())
+    
+    def weights_from_key(self, weights_key):
+        """Словарь весов из кортежа weights_key"""
+        return dict(zip(self.DEFAULT_WEIGHTS, weights_key))
+    
+    def similarity_matrix(self, weights=None):
+        """
+        Матрица схожести для заданных весов.
+        Для весов по умолчанию - self.S, для остальных - кэш по кортежу весов
+        """
+        key = self.weights_key(weights)
+        if key == self.weights_key():
+            return self.S
+        
+        if key not in self._weighted_similarity:
+            if len(self._weighted_similarity) >= self.WEIGHTED_CACHE_SIZE:
+                # Вытесняем самый старый набор весов
+                self._weighted_similarity.pop(next(iter(self._weighted_similarity)))
+            similarity = 1.0 - self.pairwise_matrix(self.weights_from_key(key))
+            similarity.setflags(write=False)
+            self._weighted_similarity[key] = similarity
+        return self._weighted_similarity[key]
+    
+    def cached_result(self, name, key, compute):
+        """
+        Результат compute() для ключа key из кэша экземпляра (отдельный LRU на каждое имя вычисления).
+        Кэш живет и удаляется вместе с метриками, не удерживая их матрицы
+        """
+        cache = self._result_cache.setdefault(name, OrderedDict())
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        
+        result = compute()
+        cache[key] = result
+        if len(cache) > self.RESULT_CACHE_SIZE:
+            cache.popitem(last=False)
+        return result
+    
     def similarity_score(self, book1_idx, book2_idx, weights=None):
         """
-        Оценка схожести между книгами (1 - distance)
+        Оценка схожести между книгами (1 - distance) - чтение из кэшированной матрицы схожести
         """
-        distance = self.composite_distance(book1_idx, book2_idx, weights)
-        return 1.0 - distance
+        return self.similarity_matrix(weights)[book1_idx, book2_idx]
     
     def get_similar_books(self, book_idx, n=5, weights=None):
         """
         Найти n наиболее похожих книг
         """
-        similarities = []
+        # Строка считается во float64, а не берется из float32-матрицы S:
+        # выводимые оценки и порядок близких значений совпадают с попарным расчетом
+        scores = 1.0 - self.distance_row(book_idx, weights)
+        scores[book_idx] = -np.inf
         
-        for i in range(len(self.df)):
-            if i != book_idx:
-                sim = self.similarity_score(book_idx, i, weights)
-                similarities.append((i, sim))
-        
-        # Сортировка по убыванию схожести
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        return similarities[:n]
-
+        # Частичная сортировка: упорядочиваем только n лучших
+        top = top_k_indices(scores, min(n, len(scores) - 1))
+        return [(int(i), scores[i]) for i in top]
@@ -1,38 +1,29 @@
-from BookDistance import BookDistanceMetrics
+from BookDistance import BookDistanceMetrics, top_k_indices
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import MinMaxScaler
+import sys
 from collections import Counter
 
 
 def create_distance_matrix(metrics, weights=None):
-    """Создание матрицы расстояний между всеми книгами"""
-    n = len(metrics.df)
-    distance_matrix = np.zeros((n, n))
-
-    for i in range(n):
-        for j in range(i + 1, n):
-            dist = metrics.composite_distance(i, j, weights)
-            distance_matrix[i, j] = dist
-            distance_matrix[j, i] = dist
-
-    return distance_matrix
+    """Создание матрицы расстояний между всеми книгами (из кэшированной в metrics матрицы схожести)"""
+    return 1.0 - metrics.similarity_matrix(weights)
 
 
 def recommend_books(metrics, target_book_idx, n_recommendations=5, weights=None):
     """Рекомендация книг на основе схожести с одной книгой"""
     similar_books = metrics.get_similar_books(target_book_idx, n_recommendations, weights)
 
-    target_book = metrics.df.iloc[target_book_idx]
-    print(f"Рекомендации для '{target_book['title']}' ({target_book['author']}):")
-    print(f"  Жанр: {target_book['genre']}")
+    titles, authors, genres = metrics._col['title'], metrics._col['author'], metrics._col['genre']
+
+    print(f"Рекомендации для '{titles[target_book_idx]}' ({authors[target_book_idx]}):")
+    print(f"  Жанр: {genres[target_book_idx]}")
 
     print("-" * 50)
 
     for idx, similarity in similar_books:
-        book = metrics.df.iloc[idx]
-        print(f"• {book['title']} ({book['author']})")
-        print(f"  Жанр: {book['genre']}, Схожесть: {similarity:.3f}")
+        print(f"• {titles[idx]} ({authors[idx]})")
+        print(f"  Жанр: {genres[idx]}, Схожесть: {similarity:.3f}")
         print()
 
 
@@ -60,9 +51,7 @@ def recommend_based_on_multiple_likes(metrics, liked_book_indices, n_recommendat
     if disliked_book_indices is None:
         disliked_book_indices = []
     
-    # Получаем информацию о понравившихся и непонравившихся книгах
-    liked_books = [metrics.df.iloc[idx] for idx in liked_book_indices]
-    disliked_books = [metrics.df.iloc[idx] for idx in disliked_book_indices]
+    titles, authors, genres = metrics._col['title'], metrics._col['author'], metrics._col['genre']
     
     print("=" * 70)
     print("РЕКОМЕНДАЦИИ НА ОСНОВЕ ВАШИХ ПРЕДПОЧТЕНИЙ:")
@@ -70,188 +59,173 @@ def recommend_based_on_multiple_likes(metrics, liked_book_indices, n_recommendat
     
     print("👍 ПОНРАВИЛИСЬ:")
     for i, idx in enumerate(liked_book_indices):
-        book = metrics.df.iloc[idx]
-        print(f"  {i+1}. '{book['title']}' - {book['author']} ({book['genre']})")
+        print(f"  {i+1}. '{titles[idx]}' - {authors[idx]} ({genres[idx]})")
     
     if disliked_book_indices:
         print("\n👎 НЕ ПОНРАВИЛИСЬ:")
         for i, idx in enumerate(disliked_book_indices):
-            book = metrics.df.iloc[idx]
-            print(f"  {i+1}. '{book['title']}' - {book['author']} ({book['genre']})")
+            print(f"  {i+1}. '{titles[idx]}' - {authors[idx]} ({genres[idx]})")
     print()
     
     # Получаем оценки для ВСЕХ книг с учетом стратегии
-    if strategy == 'combined':
-        all_scores = _combined_strategy_all_books(metrics, liked_book_indices, weights, exclude_liked)
-    elif strategy == 'average':
-        all_scores = _average_strategy_all_books(metrics, liked_book_indices, weights, exclude_liked)
-    elif strategy == 'union':
-        all_scores = _union_strategy_all_books(metrics, liked_book_indices, weights, exclude_liked)
-    elif strategy == 'content_boost':
-        all_scores = _content_boost_strategy_all_books(metrics, liked_book_indices, weights, exclude_liked)
-    else:
-        all_scores = _combined_strategy_all_books(metrics, liked_book_indices, weights, exclude_liked)
+    strategy_function = _STRATEGIES.get(strategy, _combined_strategy_all_books)
+    all_scores, liked_similarity = strategy_function(metrics, liked_book_indices, weights, exclude_liked)
+    
+    # Срезы схожести с лайками и дизлайками переиспользуются в штрафе и выводе
+    # (анализ в выводе всегда по весам по умолчанию)
+    if weights is not None:
+        liked_similarity = metrics.S[:, liked_book_indices]
+    disliked_similarity = metrics.S[:, disliked_book_indices]
     
     # Применяем штраф за дизлайки ко ВСЕМ книгам
     if disliked_book_indices:
-        all_scores = _apply_dislike_penalty_all_books(metrics, all_scores, disliked_book_indices, penalty_factor)
+        all_scores = _apply_dislike_penalty_all_books(all_scores, disliked_similarity, disliked_book_indices,
+                                                      penalty_factor)
     
-    # Теперь сортируем ВСЕ книги по скорректированной оценке и выбираем лучшие
-    all_recommendations = sorted(all_scores.items(), key=lambda x: x[1], reverse=True)
-    recommendations = all_recommendations[:n_recommendations]
+    # Выбираем лучшие книги по скорректированной оценке
+    recommendations = _top_recommendations(all_scores, n_recommendations)
     
     # Выводим рекомендации
-    _display_recommendations(metrics, recommendations, liked_books, disliked_books)
+    _display_recommendations(metrics, recommendations, liked_book_indices, disliked_book_indices,
+                             liked_similarity, disliked_similarity)
     
     return recommendations
 
 
-def _apply_dislike_penalty_all_books(metrics, all_scores, disliked_indices, penalty_factor):
-    """Применяет штраф ко ВСЕМ книгам на основе дизлайков"""
-    penalized_scores = {}
+def _top_recommendations(all_scores, n_recommendations):
+    """Выбор n лучших книг без полной сортировки всех оценок (исключенные книги имеют -inf)"""
+    available = np.flatnonzero(all_scores > -np.inf)
+    top = available[top_k_indices(all_scores[available], n_recommendations)]
+    return [(int(book_idx), all_scores[book_idx]) for book_idx in top]
+
+
+def _apply_dislike_penalty_all_books(all_scores, disliked_similarity, disliked_indices, penalty_factor):
+    """Применяет штраф ко ВСЕМ книгам на основе дизлайков (disliked_similarity - срез S[:, disliked])"""
+    # Максимальная схожесть каждой книги с дизлайками (одной операцией по срезу матрицы S)
+    max_dislike_similarity = np.maximum(disliked_similarity.max(axis=1), 0)
     
-    for book_idx, similarity in all_scores.items():
-        if book_idx in disliked_indices:
-            continue  # Полностью исключаем дизлайки
-            
-        # Вычисляем схожесть с дизлайками
-        max_dislike_similarity = 0
-        for dislike_idx in disliked_indices:
-            dislike_sim = metrics.similarity_score(book_idx, dislike_idx)
-            max_dislike_similarity = max(max_dislike_similarity, dislike_sim)
-        
-        # Применяем штраф
-        penalty = max_dislike_similarity * penalty_factor
-        penalized_similarity = similarity * (1 - penalty)
-        
-        penalized_scores[book_idx] = max(penalized_similarity, 0)
+    # Применяем штраф ко всем неисключенным книгам
+    penalty = max_dislike_similarity * penalty_factor
+    scored = all_scores > -np.inf
+    penalized_scores = np.full_like(all_scores, -np.inf)
+    penalized_scores[scored] = np.maximum(all_scores[scored] * (1 - penalty[scored]), 0)
     
+    # Полностью исключаем дизлайки
+    penalized_scores[disliked_indices] = -np.inf
     return penalized_scores
 
 
+def _exclude_liked(scores, liked_indices, exclude_liked):
+    """Копия оценок без понравившихся книг (оценка -inf), если их нужно исключить"""
+    scores = scores.copy()
+    if exclude_liked:
+        scores[liked_indices] = -np.inf
+    return scores
+
+
+def _strategy_scores(metrics, liked_indices, weights):
+    """
+    Оценки всех стратегий для набора лайков (до исключения лайков и штрафа).
+    Результат кэшируется по набору лайков и кортежу весов
+    """
+    # Ключ - кортеж лайков (порядок важен для самого частого жанра/автора) и кортеж весов
+    key = (tuple(liked_indices), metrics.weights_key(weights))
+    return metrics.cached_result('strategy_scores', key,
+                                 lambda: _compute_strategy_scores(metrics, list(liked_indices), weights))
+
+
+def _compute_strategy_scores(metrics, liked_indices, weights):
+    """Средняя и максимальная схожесть с лайками, усиленная средняя и сам срез S[:, liked] для ВСЕХ книг"""
+    liked_similarity = metrics.similarity_matrix(weights)[:, liked_indices]
+    average = liked_similarity.mean(axis=1, dtype=np.float64)  # Накопление сразу в float64
+    union = np.maximum(liked_similarity.max(axis=1), 0)
+    boosted = _boost_by_common_features(metrics, liked_indices, average)
+    scores = {'average': average, 'union': union, 'combined': boosted, 'content_boost': boosted,
+              'liked_similarity': liked_similarity}
+    for array in scores.values():
+        array.setflags(write=False)
+    return scores
+
+
 def _combined_strategy_all_books(metrics, liked_indices, weights, exclude_liked):
     """Комбинированная стратегия: усреднение + усиление по общим признакам для ВСЕХ книг"""
-    # Шаг 1: Вычисляем среднее расстояние до всех понравившихся книг для ВСЕХ книг
-    book_scores = {}
-    
-    for book_idx in range(len(metrics.df)):
-        if exclude_liked and book_idx in liked_indices:
-            continue
-            
-        total_similarity = 0
-        for liked_idx in liked_indices:
-            similarity = metrics.similarity_score(book_idx, liked_idx, weights)
-            total_similarity += similarity
-        
-        avg_similarity = total_similarity / len(liked_indices)
-        book_scores[book_idx] = avg_similarity
-    
-    # Шаг 2: Усиливаем рекомендации с общими признаками для ВСЕХ книг
-    boosted_scores = _boost_by_common_features(metrics, liked_indices, book_scores)
-    
-    return boosted_scores
+    scores = _strategy_scores(metrics, liked_indices, weights)
+    return _exclude_liked(scores['combined'], liked_indices, exclude_liked), scores['liked_similarity']
 
 
 def _average_strategy_all_books(metrics, liked_indices, weights, exclude_liked):
     """Стратегия усреднения: простая средняя схожесть для ВСЕХ книг"""
-    book_scores = {}
-    
-    for book_idx in range(len(metrics.df)):
-        if exclude_liked and book_idx in liked_indices:
-            continue
-            
-        total_similarity = 0
-        for liked_idx in liked_indices:
-            similarity = metrics.similarity_score(book_idx, liked_idx, weights)
-            total_similarity += similarity
-        
-        avg_similarity = total_similarity / len(liked_indices)
-        book_scores[book_idx] = avg_similarity
-    
-    return book_scores
+    scores = _strategy_scores(metrics, liked_indices, weights)
+    return _exclude_liked(scores['average'], liked_indices, exclude_liked), scores['liked_similarity']
 
 
 def _union_strategy_all_books(metrics, liked_indices, weights, exclude_liked):
-    """Стратегия объединения: берем лучшие рекомендации от каждой книги для ВСЕХ книг"""
-    # Создаем временный словарь для хранения максимальной схожести
-    max_scores = {}
-    
-    for book_idx in range(len(metrics.df)):
-        if exclude_liked and book_idx in liked_indices:
-            continue
-            
-        # Для каждой книги находим максимальную схожесть с любой понравившейся книгой
-        max_similarity = 0
-        for liked_idx in liked_indices:
-            similarity = metrics.similarity_score(book_idx, liked_idx, weights)
-            max_similarity = max(max_similarity, similarity)
-        
-        max_scores[book_idx] = max_similarity
-    
-    return max_scores
+    """Стратегия объединения: максимальная схожесть с любой понравившейся книгой для ВСЕХ книг"""
+    scores = _strategy_scores(metrics, liked_indices, weights)
+    return _exclude_liked(scores['union'], liked_indices, exclude_liked), scores['liked_similarity']
 
 
 def _content_boost_strategy_all_books(metrics, liked_indices, weights, exclude_liked):
     """Стратегия усиления контента: усиление рекомендаций с общими признаками для ВСЕХ книг"""
-    # Сначала получаем базовые оценки для ВСЕХ книг через усреднение
-    base_scores = _average_strategy_all_books(metrics, liked_indices, weights, exclude_liked)
-    
-    # Усиливаем на основе общих признаков для ВСЕХ книг
-    boosted_scores = _boost_by_common_features(metrics, liked_indices, base_scores)
-    
-    return boosted_scores
+    scores = _strategy_scores(metrics, liked_indices, weights)
+    return _exclude_liked(scores['content_boost'], liked_indices, exclude_liked), scores['liked_similarity']
+
+
+# Стратегии по имени (неизвестное имя - комбинированная стратегия)
+_STRATEGIES = {
+    'combined': _combined_strategy_all_books,
+    'average': _average_strategy_all_books,
+    'union': _union_strategy_all_books,
+    'content_boost': _content_boost_strategy_all_books,
+}
 
 
 def _boost_by_common_features(metrics, liked_indices, book_scores):
     """Усиление оценок на основе общих признаков с понравившимися книгами"""
-    boosted_scores = book_scores.copy()
+    genre_codes = metrics.genre_codes
+    author_codes = metrics._cat['author']
     
     # Анализируем общие черты понравившихся книг
-    liked_books = [metrics.df.iloc[idx] for idx in liked_indices]
+    liked_genres = genre_codes[liked_indices]
+    liked_authors = author_codes[liked_indices]
     
     # Находим наиболее частые признаки
-    genres = [book['genre'] for book in liked_books]
-    authors = [book['author'] for book in liked_books]
+    most_common_genre = Counter(liked_genres.tolist()).most_common(1)[0][0]
+    most_common_author = Counter(liked_authors.tolist()).most_common(1)[0][0]
     
-    genre_counter = Counter(genres)
-    author_counter = Counter(authors)
+    # Неуказанный жанр/автор (код -1) не совпадает ни с одной книгой, в том числе с другим пропуском
+    has_genre = genre_codes >= 0
+    has_author = author_codes >= 0
     
-    most_common_genre = genre_counter.most_common(1)[0][0] if genre_counter else None
-    most_common_author = author_counter.most_common(1)[0][0] if author_counter else None
+    # Число совпадений жанра/автора каждой книги с понравившимися
+    matching_genres = (genre_codes[:, None] == liked_genres[None, :]).sum(axis=1) * has_genre
+    matching_authors = (author_codes[:, None] == liked_authors[None, :]).sum(axis=1) * has_author
     
-    # Усиливаем книги с общими признаками
-    for book_idx in boosted_scores:
-        book = metrics.df.iloc[book_idx]
-        
-        boost = 1.0
-        
-        # Усиление за общий жанр
-        if most_common_genre and book['genre'] == most_common_genre:
-            boost *= 1.2
-        
-        # Усиление за общего автора
-        if most_common_author and book['author'] == most_common_author:
-            boost *= 1.3
-        
-        # Усиление за множественные совпадения жанров
-        matching_genres = sum(1 for liked_genre in genres if liked_genre == book['genre'])
-        if matching_genres > 1:
-            boost *= (1 + 0.15 * matching_genres)
-
-        # Усиление за множественные совпадения автора
-        matching_authors = sum(1 for liked_author in authors if liked_author == book['author'])
-        if matching_authors > 1:
-            boost *= (1 + 0.2 * matching_authors)
-        
-        boosted_scores[book_idx] *= boost
+    boost = np.ones(len(genre_codes))
+    
+    # Усиление за общий жанр и общего автора
+    boost *= np.where(has_genre & (genre_codes == most_common_genre), 1.2, 1.0)
+    boost *= np.where(has_author & (author_codes == most_common_author), 1.3, 1.0)
     
-    return boosted_scores
+    # Усиление за множественные совпадения жанров и авторов
+    boost *= np.where(matching_genres > 1, 1 + 0.15 * matching_genres, 1.0)
+    boost *= np.where(matching_authors > 1, 1 + 0.2 * matching_authors, 1.0)
+    
+    return book_scores * boost
 
 
-def _display_recommendations(metrics, recommendations, liked_books, disliked_books=None):
-    """Отображение рекомендаций с анализом"""
-    if disliked_books is None:
-        disliked_books = []
+def _display_recommendations(metrics, recommendations, liked_indices, disliked_indices=None,
+                             liked_similarity=None, disliked_similarity=None):
+    """
+    Отображение рекомендаций с анализом.
+    liked_similarity / disliked_similarity - срезы S[:, liked] и S[:, disliked], посчитанные при ранжировании
+    """
+    if disliked_indices is None:
+        disliked_indices = []
+    if liked_similarity is None:
+        liked_similarity = metrics.S[:, liked_indices]
+    if disliked_similarity is None:
+        disliked_similarity = metrics.S[:, disliked_indices]
         
     print("ТОП РЕКОМЕНДАЦИЙ:")
     print("-" * 70)
@@ -260,29 +234,24 @@ def _display_recommendations(metrics, recommendations, liked_books, disliked_boo
         print("Не найдено подходящих рекомендаций с учетом ваших предпочтений")
         return
     
+    col = metrics._col
+    titles, authors, genres = col['title'], col['author'], col['genre']
+    
     for i, (book_idx, similarity) in enumerate(recommendations, 1):
-        book = metrics.df.iloc[book_idx]
-        
         # Находим наиболее похожие книги из понравившихся
         best_matches = []
-        for liked in liked_books:
-            liked_idx = metrics.df[metrics.df['title'] == liked['title']].index[0]
-            sim = metrics.similarity_score(book_idx, liked_idx)
-            best_matches.append((liked['title'], sim))
+        for k, liked_idx in enumerate(liked_indices):
+            sim = liked_similarity[book_idx, k]
+            best_matches.append((titles[liked_idx], sim))
         
         best_matches.sort(key=lambda x: x[1], reverse=True)
         top_match = best_matches[0] if best_matches else ("", 0)
         
         # Проверяем схожесть с дизлайками
-        max_dislike_similarity = 0
-        if disliked_books:
-            for disliked in disliked_books:
-                disliked_idx = metrics.df[metrics.df['title'] == disliked['title']].index[0]
-                dislike_sim = metrics.similarity_score(book_idx, disliked_idx)
-                max_dislike_similarity = max(max_dislike_similarity, dislike_sim)
+        max_dislike_similarity = disliked_similarity[book_idx].max(initial=0.0)
         
-        print(f"{i}. {book['title']} - {book['author']}")
-        print(f"   Жанр: {book['genre']}, Год: {book['year']}, Страниц: {book['pages']}")
+        print(f"{i}. {titles[book_idx]} - {authors[book_idx]}")
+        print(f"   Жанр: {genres[book_idx]}, Год: {col['year'][book_idx]}, Страниц: {col['pages'][book_idx]}")
         print(f"   Общая схожесть: {similarity:.3f}")
         
         if top_match[1] > 0:
@@ -293,11 +262,11 @@ def _display_recommendations(metrics, recommendations, liked_books, disliked_boo
         
         # Показываем общие черты с понравившимися книгами
         common_features = []
-        for liked in liked_books:
-            if book['genre'] == liked['genre']:
-                common_features.append(f"жанр '{liked['genre']}'")
-            if book['author'] == liked['author']:
-                common_features.append(f"автор {liked['author']}")
+        for liked_idx in liked_indices:
+            if genres[book_idx] == genres[liked_idx]:
+                common_features.append(f"жанр '{genres[liked_idx]}'")
+            if authors[book_idx] == authors[liked_idx]:
+                common_features.append(f"автор {authors[liked_idx]}")
         
         if common_features:
             print(f"   ✅ Общие черты: {', '.join(set(common_features))}")
@@ -311,9 +280,11 @@ def interactive_recommendations(metrics):
     print("=" * 50)
     
     # Показываем список всех книг
-    for i in range(len(metrics.df)):
-        book = metrics.df.iloc[i]
-        print(f"{i:2d}. {book['title']} - {book['author']} ({book['genre']})")
+    # (одной записью в консоль вместо print на каждую строку)
+    col = metrics._col
+    lines = [f"{i:2d}. {title} - {author} ({genre})"
+             for i, (title, author, genre) in enumerate(zip(col['title'], col['author'], col['genre']))]
+    sys.stdout.write('\n'.join(lines) + '\n')
     
     while True:
         print("\n" + "="*50)
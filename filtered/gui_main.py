@@ -1,14 +1,29 @@
-from BookDistance import BookDistanceMetrics
+from BookDistance import BookDistanceMetrics, top_k_indices
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import MinMaxScaler
 from collections import Counter
+import threading
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import seaborn as sns
 
+
+# Компактные типы числовых столбцов: год и возраст помещаются в int16/int8, иллюстрации - флаг
+BOOK_DTYPES = {'year': 'int16', 'pages': 'int32', 'age_restriction': 'int8', 'has_illustrations': 'bool'}
+
+
+def load_books(path):
+    """Загрузка датасета книг: многопоточный парсер pyarrow, если он установлен, иначе стандартный"""
+    try:
+        df = pd.read_csv(path, engine='pyarrow')
+    except ImportError:
+        df = pd.read_csv(path)
+    # Столбцы с пропусками остаются в исходном типе: NaN не помещается в int/bool
+    return df.astype({column: dtype for column, dtype in BOOK_DTYPES.items() if df[column].notna().all()})
+
+
 class BookRecommendationGUI:
     def __init__(self, root):
         self.root = root
@@ -16,14 +31,57 @@ class BookRecommendationGUI:
         self.root.geometry("1200x800")
         
         # Загрузка данных
-        self.df = pd.read_csv('../DataBooks.csv')
+        self.df = load_books('../DataBooks.csv')
+        self._col = {column: self.df[column].to_numpy() for column in self.df.columns}  # Столбцы как массивы
+        self._setup_category_codes()
+        # Отсортированные уникальные значения для списков фильтров
+        self._uniques = {column: sorted(self.df[column].dropna().unique().tolist())
+                         for column in ['genre', 'author', 'publisher', 'language', 'age_restriction']}
         self.filtered_df = self.df.copy()
-        self.metrics_full = BookDistanceMetrics(self.df)  # Метрики для полного датасета
-        self.metrics_filtered = None  # Метрики для отфильтрованного датасета
+        self.filtered_to_full = np.arange(len(self.df))  # Индексы отфильтрованных книг в полном датасете
+        self.metrics_full = None  # Метрики для полного датасета (строятся в фоновом потоке)
+        self.update_statistics()
         
         self.setup_gui()
         # Заполняем списки лайков/дизлайков при инициализации
         self.update_recommendation_lists()
+        
+        # Метрики полного датасета (с матрицей схожести всех пар) строятся в фоне,
+        # чтобы окно появилось сразу; готовность проверяется из главного потока Tk
+        self._full_metrics_result = None
+        self._metrics_thread = threading.Thread(target=self._build_full_metrics, daemon=True)
+        self._metrics_thread.start()
+        self.root.after(100, self._check_metrics_ready)
+    
+    def _build_full_metrics(self):
+        # Выполняется в фоновом потоке: виджеты Tk здесь не используются
+        try:
+            metrics = BookDistanceMetrics(self.df)
+            metrics.S  # Матрица схожести считается сразу, а не при первом запросе
+            self._full_metrics_result = metrics
+        except Exception as e:
+            self._full_metrics_result = e
+    
+    def _check_metrics_ready(self):
+        if self._metrics_thread.is_alive():
+            self.root.after(100, self._check_metrics_ready)
+            return
+        
+        if isinstance(self._full_metrics_result, Exception):
+            # Рекомендации недоступны: кнопка не должна оставаться в состоянии загрузки
+            self.recommend_button.config(text="Ошибка загрузки метрик", state='disabled')
+            messagebox.showerror("Ошибка", f"Не удалось построить метрики: {str(self._full_metrics_result)}")
+            return
+        
+        self.metrics_full = self._full_metrics_result
+        self.recommend_button.config(text="Получить рекомендации", state='normal')
+    
+    def _setup_category_codes(self):
+        # Категориальные признаки как узкие целочисленные коды (сравнение без строк)
+        self._codes = {}
+        for column in ['genre', 'author', 'publisher', 'language']:
+            codes, uniques = pd.factorize(self.df[column])
+            self._codes[column] = codes.astype(np.int16 if len(uniques) < 2 ** 15 else np.int32)
     
     def show_statistics(self):
         # Создаем окно со статистикой
@@ -31,39 +89,56 @@ class BookRecommendationGUI:
         stats_window.title("Статистика данных")
         stats_window.geometry("600x400")
         
+        # У каждого окна своя фигура: холст Tk меняет ее размер под окно,
+        # поэтому между окнами переиспользуются только агрегаты self._stats
+        figure = self._build_statistics_figure()
+        
+        # Встраиваем график в Tkinter
+        canvas = FigureCanvasTkAgg(figure, master=stats_window)
+        canvas.draw()
+        canvas.get_tk_widget().pack(fill='both', expand=True)
+    
+    def _build_statistics_figure(self):
         # Создаем графики
-        fig, axes = plt.subplots(2, 2, figsize=(12, 10))
+        fig = Figure(figsize=(12, 10))
+        axes = fig.subplots(2, 2)
         
         # Распределение по жанрам
-        genre_counts = self.filtered_df['genre'].value_counts()
+        genre_counts = self._stats['genre']
         axes[0, 0].pie(genre_counts.values, labels=genre_counts.index, autopct='%1.1f%%')
         axes[0, 0].set_title('Распределение по жанрам')
         
         # Распределение по годам
-        year_counts = self.filtered_df['year'].value_counts().sort_index()
+        year_counts = self._stats['year']
         axes[0, 1].bar(year_counts.index, year_counts.values)
         axes[0, 1].set_title('Распределение по годам')
         axes[0, 1].tick_params(axis='x', rotation=45)
         
         # Распределение по количеству страниц
-        axes[1, 0].hist(self.filtered_df['pages'], bins=10, alpha=0.7)
+        page_counts, page_bins = self._stats['pages']
+        axes[1, 0].hist(page_bins[:-1], bins=page_bins, weights=page_counts, alpha=0.7)
         axes[1, 0].set_title('Распределение по страницам')
         axes[1, 0].set_xlabel('Количество страниц')
         axes[1, 0].set_ylabel('Частота')
         
         # Топ авторов
-        author_counts = self.filtered_df['author'].value_counts().head(10)
+        author_counts = self._stats['author']
         axes[1, 1].barh(range(len(author_counts)), author_counts.values)
         axes[1, 1].set_yticks(range(len(author_counts)))
         axes[1, 1].set_yticklabels(author_counts.index)
         axes[1, 1].set_title('Топ авторов')
         
-        plt.tight_layout()
-        
-        # Встраиваем график в Tkinter
-        canvas = FigureCanvasTkAgg(fig, master=stats_window)
-        canvas.draw()
-        canvas.get_tk_widget().pack(fill='both', expand=True)
+        fig.tight_layout()
+        return fig
+    
+    def update_statistics(self):
+        # Агрегаты для окна статистики считаются один раз при смене отфильтрованных данных
+        self._stats = {
+            'genre': self.filtered_df['genre'].value_counts(),
+            'year': self.filtered_df['year'].value_counts().sort_index(),
+            'pages': np.histogram(self.filtered_df['pages'].to_numpy(), bins=10),
+            'author': self.filtered_df['author'].value_counts().head(10),
+        }
 
     
     def setup_gui(self):
@@ -86,9 +161,7 @@ class BookRecommendationGUI:
         # Жанры (множественный выбор)
         ttk.Label(self.filter_frame, text="Жанры:").grid(row=0, column=0, sticky='w', padx=5, pady=5)
         self.genre_listbox = tk.Listbox(self.filter_frame, selectmode=tk.MULTIPLE, height=4, exportselection=False)
-        genres = sorted(self.df['genre'].unique().tolist())
-        for genre in genres:
-            self.genre_listbox.insert(tk.END, genre)
+        self.genre_listbox.insert(tk.END, *self._uniques['genre'])
         self.genre_listbox.grid(row=0, column=1, sticky='ew', padx=5, pady=5)
         
         # Год издания
@@ -116,9 +189,7 @@ class BookRecommendationGUI:
         # Авторы (множественный выбор)
         ttk.Label(self.filter_frame, text="Авторы:").grid(row=3, column=0, sticky='w', padx=5, pady=5)
         self.author_listbox = tk.Listbox(self.filter_frame, selectmode=tk.MULTIPLE, height=4, exportselection=False)
-        authors = sorted(self.df['author'].unique().tolist())
-        for author in authors:
-            self.author_listbox.insert(tk.END, author)
+        self.author_listbox.insert(tk.END, *self._uniques['author'])
         self.author_listbox.grid(row=3, column=1, sticky='ew', padx=5, pady=5)
 
         # Издательство (множественный выбор)
@@ -127,9 +198,7 @@ class BookRecommendationGUI:
         publisher_frame.grid(row=4, column=1, sticky='ew', padx=5, pady=5)
         
         self.publisher_listbox = tk.Listbox(publisher_frame, selectmode=tk.MULTIPLE, height=4, exportselection=False)
-        publishers = sorted(self.df['publisher'].unique().tolist())
-        for publisher in publishers:
-            self.publisher_listbox.insert(tk.END, publisher)
+        self.publisher_listbox.insert(tk.END, *self._uniques['publisher'])
         
         # Добавляем скроллбар для списка издательств
         publisher_scrollbar = ttk.Scrollbar(publisher_frame, orient=tk.VERTICAL, command=self.publisher_listbox.yview)
@@ -141,14 +210,14 @@ class BookRecommendationGUI:
         # Язык
         ttk.Label(self.filter_frame, text="Язык:").grid(row=5, column=0, sticky='w', padx=5, pady=5)
         self.language_var = tk.StringVar(value="Все")
-        languages = ["Все"] + sorted(self.df['language'].unique().tolist())
+        languages = ["Все"] + self._uniques['language']
         self.language_combo = ttk.Combobox(self.filter_frame, textvariable=self.language_var, values=languages, state="readonly")
         self.language_combo.grid(row=5, column=1, sticky='ew', padx=5, pady=5)
 
         # Возрастное ограничение
         ttk.Label(self.filter_frame, text="Возрастное ограничение:").grid(row=6, column=0, sticky='w', padx=5, pady=5)
         self.age_var = tk.StringVar(value="Все")
-        ages = ["Все"] + sorted(self.df['age_restriction'].unique().tolist())
+        ages = ["Все"] + self._uniques['age_restriction']
         self.age_combo = ttk.Combobox(self.filter_frame, textvariable=self.age_var, values=ages, state="readonly")
         self.age_combo.grid(row=6, column=1, sticky='ew', padx=5, pady=5)
 
@@ -261,7 +330,10 @@ class BookRecommendationGUI:
         ttk.Label(settings_frame, textvariable=self.penalty_var).grid(row=2, column=4, padx=5)
         
         # Кнопка получения рекомендаций
-        ttk.Button(left_frame, text="Получить рекомендации", command=self.get_recommendations).pack(pady=10)
+        # (недоступна, пока в фоне строятся метрики полного датасета)
+        self.recommend_button = ttk.Button(left_frame, text="Загрузка метрик...", command=self.get_recommendations,
+                                           state='disabled')
+        self.recommend_button.pack(pady=10)
         
         # Область для вывода рекомендаций
         ttk.Label(right_frame, text="Рекомендации:").pack(anchor='w')
@@ -271,72 +343,71 @@ class BookRecommendationGUI:
         
         # Кнопка очистки
         ttk.Button(right_frame, text="Очистить рекомендации", command=self.clear_recommendations).pack(pady=5)
-        
-        # Обновляем списки книг
-        self.update_recommendation_lists()
     
     def apply_filters(self):
         try:
-            # Применяем фильтры
-            filtered_df = self.df.copy()
+            # Применяем фильтры: все условия собираются в одну булеву маску по полному датасету
+            col = self._col
+            mask = np.ones(len(self.df), dtype=bool)
             
             # Фильтр по жанру (множественный выбор)
             selected_genres = [self.genre_listbox.get(i) for i in self.genre_listbox.curselection()]
             if selected_genres:
-                filtered_df = filtered_df[filtered_df['genre'].isin(selected_genres)]
+                mask &= np.isin(col['genre'], selected_genres)
             
             # Фильтр по авторам (множественный выбор)
             selected_authors = [self.author_listbox.get(i) for i in self.author_listbox.curselection()]
             if selected_authors:
-                filtered_df = filtered_df[filtered_df['author'].isin(selected_authors)]
+                mask &= np.isin(col['author'], selected_authors)
             
             # Фильтр по издательствам (множественный выбор)
             selected_publishers = [self.publisher_listbox.get(i) for i in self.publisher_listbox.curselection()]
             if selected_publishers:
-                filtered_df = filtered_df[filtered_df['publisher'].isin(selected_publishers)]
+                mask &= np.isin(col['publisher'], selected_publishers)
             
             # Фильтр по языку
             if self.language_var.get() != "Все":
-                filtered_df = filtered_df[filtered_df['language'] == self.language_var.get()]
+                mask &= col['language'] == self.language_var.get()
             
             # Фильтр по возрастному ограничению
             if self.age_var.get() != "Все":
                 age_value = int(self.age_var.get())
-                filtered_df = filtered_df[filtered_df['age_restriction'] == age_value]
+                mask &= col['age_restriction'] == age_value
             
             # Фильтр по иллюстрациям
             if self.illustrations_var.get() != "Все":
-                has_illustrations = 1 if self.illustrations_var.get() == "Есть" else 0
-                filtered_df = filtered_df[filtered_df['has_illustrations'] == has_illustrations]
+                has_illustrations = self.illustrations_var.get() == "Есть"
+                mask &= col['has_illustrations'] == has_illustrations
             
             # Фильтр по названию (поиск)
             if self.title_var.get():
-                filtered_df = filtered_df[filtered_df['title'].str.contains(self.title_var.get(), case=False, na=False)]
+                mask &= self.df['title'].str.contains(self.title_var.get(), case=False, na=False).to_numpy()
             
             # Фильтр по году
-            year_min = int(self.year_min_var.get()) if self.year_min_var.get() else self.df['year'].min()
-            year_max = int(self.year_max_var.get()) if self.year_max_var.get() else self.df['year'].max()
-            filtered_df = filtered_df[(filtered_df['year'] >= year_min) & (filtered_df['year'] <= year_max)]
+            year_min = int(self.year_min_var.get()) if self.year_min_var.get() else col['year'].min()
+            year_max = int(self.year_max_var.get()) if self.year_max_var.get() else col['year'].max()
+            mask &= (col['year'] >= year_min) & (col['year'] <= year_max)
             
             # Фильтр по страницам
-            pages_min = int(self.pages_min_var.get()) if self.pages_min_var.get() else self.df['pages'].min()
-            pages_max = int(self.pages_max_var.get()) if self.pages_max_var.get() else self.df['pages'].max()
-            filtered_df = filtered_df[(filtered_df['pages'] >= pages_min) & (filtered_df['pages'] <= pages_max)]
+            pages_min = int(self.pages_min_var.get()) if self.pages_min_var.get() else col['pages'].min()
+            pages_max = int(self.pages_max_var.get()) if self.pages_max_var.get() else col['pages'].max()
+            mask &= (col['pages'] >= pages_min) & (col['pages'] <= pages_max)
             
-            self.filtered_df = filtered_df.reset_index(drop=True)
+            # Одна выборка из полного датасета вместо копии на каждый фильтр
+            self.filtered_to_full = np.flatnonzero(mask)
+            self.filtered_df = self.df[mask].reset_index(drop=True)
+            self.update_statistics()
             self.update_book_table()
             
-            # Создаем метрики для отфильтрованного датасета
-            self.metrics_filtered = BookDistanceMetrics(self.filtered_df)
+            if len(self.filtered_df) == 0:
+                messagebox.showerror("Ошибка", "По вашему запросу ничего не найдено, изменьте фильтры")
+                return
             
             messagebox.showinfo("Успех", f"Найдено {len(self.filtered_df)} книг")
             
-        except ValueError as e:        
-            if str(e) == 'Found array with 0 sample(s) (shape=(0, 1)) while a minimum of 1 is required by MinMaxScaler.':        
-                # Ошибка преобразования типов (ввод строки вместо числа)        
-                messagebox.showerror("Ошибка", "По вашему запросу ничего не найдено, изменьте фильтры")        
-            else:        
-                messagebox.showerror("Ошибка ввода", "Введены некорректные значения")
+        except ValueError:        
+            # Ошибка преобразования типов (ввод строки вместо числа)        
+            messagebox.showerror("Ошибка ввода", "Введены некорректные значения")
 
         # except ValueError as e:
         #     messagebox.showinfo("Успех", "Не найдено книг с указанными фильтрами")
@@ -361,47 +432,40 @@ class BookRecommendationGUI:
         self.pages_max_var.set(str(self.df['pages'].max()))
         
         self.filtered_df = self.df.copy()
+        self.filtered_to_full = np.arange(len(self.df))
+        self.update_statistics()
         self.update_book_table()
         
-        # Создаем метрики для отфильтрованного датасета
-        self.metrics_filtered = BookDistanceMetrics(self.filtered_df)
-        
     def update_book_table(self):
         # Очищаем таблицу
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        self.tree.delete(*self.tree.get_children())
         
         # Заполняем таблицу отфильтрованными данными со всеми колонками
-        for idx, row in self.filtered_df.iterrows():
-            illustrations = "Есть" if row['has_illustrations'] == 1 else "Нет"
-            self.tree.insert('', 'end', values=(
-                row['title'],
-                row['author'],
-                row['publisher'],
-                row['year'],
-                row['language'],
-                row['age_restriction'],
-                row['genre'],
-                row['pages'],
-                illustrations
-            ))
+        # (строки берутся из массива значений, без построчного iterrows)
+        columns = ['title', 'author', 'publisher', 'year', 'language', 'age_restriction', 'genre', 'pages']
+        illustrations = np.where(self.filtered_df['has_illustrations'].to_numpy() == 1, "Есть", "Нет")
+        for row, has_illustrations in zip(self.filtered_df[columns].to_numpy().tolist(), illustrations):
+            self.tree.insert('', 'end', values=(*row, has_illustrations))
         
     def update_recommendation_lists(self):
         # Очищаем списки
         self.likes_listbox.delete(0, tk.END)
         self.dislikes_listbox.delete(0, tk.END)
         
-        # Заполняем списки названиями книг из ПОЛНОГО датасета
-        for idx, row in self.df.iterrows():
-            book_text = f"{row['title']} - {row['author']}"
-            self.likes_listbox.insert(tk.END, book_text)
-            self.dislikes_listbox.insert(tk.END, book_text)
+        # Заполняем списки названиями книг из ПОЛНОГО датасета (одной вставкой на список)
+        items = [f"{title} - {author}" for title, author in zip(self._col['title'], self._col['author'])]
+        self.likes_listbox.insert(tk.END, *items)
+        self.dislikes_listbox.insert(tk.END, *items)
     
     def get_recommendations(self):
         if not hasattr(self, 'filtered_df') or len(self.filtered_df) == 0:
             messagebox.showwarning("Предупреждение", "Нет данных для рекомендаций")
             return
         
+        if self.metrics_full is None:
+            messagebox.showinfo("Подождите", "Метрики еще загружаются")
+            return
+        
         try:
             # Получаем выбранные лайки и дизлайки из ВСЕГО датасета
             liked_indices_full = list(self.likes_listbox.curselection())
@@ -411,20 +475,18 @@ class BookRecommendationGUI:
                 messagebox.showwarning("Предупреждение", "Выберите хотя бы одну понравившуюся книгу")
                 return
             
-            # Создаем метрики для отфильтрованного датасета, если еще не созданы
-            if self.metrics_filtered is None:
-                self.metrics_filtered = BookDistanceMetrics(self.filtered_df)
-            
-            # Получаем рекомендации
+            # Получаем рекомендации: книги отфильтрованного датасета задаются индексами filtered_to_full
+            # в полном, поэтому отдельные метрики для него не нужны
             recommendations = recommend_based_on_multiple_likes(
-                self.metrics_full,  # Для лайков/дизлайков используем полный датасет
-                self.metrics_filtered,  # Для рекомендаций используем отфильтрованный датасет
+                self.metrics_full,  # Для лайков/дизлайков и рекомендаций используем метрики полного датасета
+                None,
                 liked_indices_full,
                 n_recommendations=self.n_rec_var.get(),
                 strategy=self.strategy_var.get(),
                 disliked_book_indices=disliked_indices_full,
                 penalty_factor=self.penalty_var.get(),
-                verbose=False
+                verbose=False,
+                filtered_to_full=self.filtered_to_full
             )
             
             # Форматируем вывод рекомендаций
@@ -437,6 +499,9 @@ class BookRecommendationGUI:
         # Очищаем текстовое поле
         self.recommendation_text.delete(1.0, tk.END)
         
+        # Столбцы полного датасета как массивы (вместо построчного iloc)
+        titles, authors, genres = self._col['title'], self._col['author'], self._col['genre']
+        
         # Выводим информацию о выбранных книгах из полного датасета
         self.recommendation_text.insert(tk.END, "=" * 70 + "\n")
         self.recommendation_text.insert(tk.END, "ВАШИ ПРЕДПОЧТЕНИЯ:\n")
@@ -444,14 +509,12 @@ class BookRecommendationGUI:
         
         self.recommendation_text.insert(tk.END, "👍 ПОНРАВИЛИСЬ:\n")
         for idx in liked_indices_full:
-            book = self.df.iloc[idx]  # Берем из полного датасета
-            self.recommendation_text.insert(tk.END, f"• {book['title']} - {book['author']}\n")
+            self.recommendation_text.insert(tk.END, f"• {titles[idx]} - {authors[idx]}\n")
         
         if disliked_indices_full:
             self.recommendation_text.insert(tk.END, "\n👎 НЕ ПОНРАВИЛИСЬ:\n")
             for idx in disliked_indices_full:
-                book = self.df.iloc[idx]  # Берем из полного датасета
-                self.recommendation_text.insert(tk.END, f"• {book['title']} - {book['author']}\n")
+                self.recommendation_text.insert(tk.END, f"• {titles[idx]} - {authors[idx]}\n")
         
         self.recommendation_text.insert(tk.END, "\n" + "=" * 70 + "\n")
         self.recommendation_text.insert(tk.END, "РЕКОМЕНДАЦИИ (из отфильтрованного датасета):\n")
@@ -461,37 +524,40 @@ class BookRecommendationGUI:
             self.recommendation_text.insert(tk.END, "Не найдено подходящих рекомендаций\n")
             return
         
+        # Схожесть всех рекомендаций со всеми лайками - один срез матрицы схожести полного датасета
+        recommended_full = self.filtered_to_full[[book_idx for book_idx, _ in recommendations]]
+        liked_similarity = self.metrics_full.S[np.ix_(recommended_full, liked_indices_full)]
+        best_columns = liked_similarity.argmax(axis=1)
+        best_similarities = liked_similarity.max(axis=1)
+        genre_codes, author_codes = self._codes['genre'], self._codes['author']
+        liked_genre_codes = genre_codes[liked_indices_full]
+        liked_author_codes = author_codes[liked_indices_full]
+        
         # Выводим рекомендации из отфильтрованного датасета
         for i, (book_idx, similarity) in enumerate(recommendations, 1):
-            book = self.filtered_df.iloc[book_idx]  # Берем из отфильтрованного датасета
+            book_full = recommended_full[i - 1]  # Книга отфильтрованного датасета в полном
             
-            self.recommendation_text.insert(tk.END, f"{i}. {book['title']} - {book['author']}\n")
-            self.recommendation_text.insert(tk.END, f"   Жанр: {book['genre']}, Год: {book['year']}, Страниц: {book['pages']}\n")
+            self.recommendation_text.insert(tk.END, f"{i}. {titles[book_full]} - {authors[book_full]}\n")
+            self.recommendation_text.insert(tk.END, f"   Жанр: {genres[book_full]}, Год: {self._col['year'][book_full]}, "
+                                                    f"Страниц: {self._col['pages'][book_full]}\n")
             self.recommendation_text.insert(tk.END, f"   Схожесть: {similarity:.3f}\n")
             
-            # Находим наиболее похожую книгу из лайков (из полного датасета)
-            best_match = None
-            best_similarity = 0
-            for liked_idx in liked_indices_full:
-                sim = self.metrics_full.similarity_score(book_idx, liked_idx)
-                if sim > best_similarity:
-                    best_similarity = sim
-                    best_match = self.df.iloc[liked_idx]  # Берем из полного датасета
-            
-            if best_match is not None:
-                self.recommendation_text.insert(tk.END, f"   Похожа на: '{best_match['title']}' (схожесть: {best_similarity:.3f})\n")
+            # Наиболее похожая книга из лайков (из полного датасета)
+            best_similarity = best_similarities[i - 1]
+            if best_similarity > 0:
+                best_match = liked_indices_full[best_columns[i - 1]]  # Берем из полного датасета
+                self.recommendation_text.insert(tk.END, f"   Похожа на: '{titles[best_match]}' (схожесть: {best_similarity:.3f})\n")
             
-            # Проверяем общие черты с лайками (из полного датасета)
+            # Проверяем общие черты с лайками (из полного датасета) одним сравнением кодов жанра и автора;
+            # совпадающий код означает жанр/автора самой рекомендованной книги
             common_features = []
-            for liked_idx in liked_indices_full:
-                liked_book = self.df.iloc[liked_idx]  # Берем из полного датасета
-                if book['genre'] == liked_book['genre']:
-                    common_features.append(f"жанр '{liked_book['genre']}'")
-                if book['author'] == liked_book['author']:
-                    common_features.append(f"автор {liked_book['author']}")
+            if (liked_genre_codes == genre_codes[book_full]).any():
+                common_features.append(f"жанр '{genres[book_full]}'")
+            if (liked_author_codes == author_codes[book_full]).any():
+                common_features.append(f"автор {authors[book_full]}")
             
             if common_features:
-                self.recommendation_text.insert(tk.END, f"   Общие черты: {', '.join(set(common_features))}\n")
+                self.recommendation_text.insert(tk.END, f"   Общие черты: {', '.join(common_features)}\n")
             
             self.recommendation_text.insert(tk.END, "\n")
     
@@ -501,42 +567,33 @@ class BookRecommendationGUI:
 
 # Функции рекомендательной системы (с исправлениями для работы с двумя датасетами)
 def create_distance_matrix(metrics, weights=None):
-    """Создание матрицы расстояний между всеми книгами"""
-    n = len(metrics.df)
-    distance_matrix = np.zeros((n, n))
-
-    for i in range(n):
-        for j in range(i + 1, n):
-            dist = metrics.composite_distance(i, j, weights)
-            distance_matrix[i, j] = dist
-            distance_matrix[j, i] = dist
-
-    return distance_matrix
+    """Создание матрицы расстояний между всеми книгами (из кэшированной в metrics матрицы схожести)"""
+    return 1.0 - metrics.similarity_matrix(weights)
 
 
 def recommend_books(metrics, target_book_idx, n_recommendations=5, weights=None):
     """Рекомендация книг на основе схожести с одной книгой"""
     similar_books = metrics.get_similar_books(target_book_idx, n_recommendations, weights)
 
-    target_book = metrics.df.iloc[target_book_idx]
-    print(f"Рекомендации для '{target_book['title']}' ({target_book['author']}):")
-    print(f"  Жанр: {target_book['genre']}")
+    titles, authors, genres = metrics._col['title'], metrics._col['author'], metrics._col['genre']
+    print(f"Рекомендации для '{titles[target_book_idx]}' ({authors[target_book_idx]}):")
+    print(f"  Жанр: {genres[target_book_idx]}")
 
     print("-" * 50)
 
     for idx, similarity in similar_books:
-        book = metrics.df.iloc[idx]
-        print(f"• {book['title']} ({book['author']})")
-        print(f"  Жанр: {book['genre']}, Схожесть: {similarity:.3f}")
+        print(f"• {titles[idx]} ({authors[idx]})")
+        print(f"  Жанр: {genres[idx]}, Схожесть: {similarity:.3f}")
         print()
 
 def recommend_based_on_multiple_likes(metrics_full, metrics_filtered, liked_book_indices, n_recommendations=10, weights=None, 
                                      exclude_liked=True, strategy='combined', disliked_book_indices=None,
-                                     penalty_factor=0.7, verbose=True):
+                                     penalty_factor=0.7, verbose=True, filtered_to_full=None):
     """
     Рекомендация книг на основе нескольких понравившихся книг
     metrics_full - для лайков/дизлайков (полный датасет)
-    metrics_filtered - для рекомендаций (отфильтрованный датасет)
+    metrics_filtered - метрики отфильтрованного датасета; нужен только его df, если не задан filtered_to_full
+    filtered_to_full - индексы книг отфильтрованного датасета в полном (None - датасеты совпадают)
     """
     
     if not liked_book_indices:
@@ -548,182 +605,242 @@ def recommend_based_on_multiple_likes(metrics_full, metrics_filtered, liked_book
     if disliked_book_indices is None:
         disliked_book_indices = []
     
+    if filtered_to_full is None:
+        filtered_to_full = np.arange(len((metrics_filtered or metrics_full).df))
+    
     if verbose:
+        # Берем книги из полного датасета для отображения
+        titles, authors, genres = metrics_full._col['title'], metrics_full._col['author'], metrics_full._col['genre']
+        
         print("=" * 70)
         print("РЕКОМЕНДАЦИИ НА ОСНОВЕ ВАШИХ ПРЕДПОЧТЕНИЙ:")
         print("=" * 70)
         
         print("👍 ПОНРАВИЛИСЬ:")
         for i, idx in enumerate(liked_book_indices):
-            # Берем книги из полного датасета для отображения
-            book = metrics_full.df.iloc[idx]
-            print(f"  {i+1}. '{book['title']}' - {book['author']} ({book['genre']})")
+            print(f"  {i+1}. '{titles[idx]}' - {authors[idx]} ({genres[idx]})")
         
         if disliked_book_indices:
             print("\n👎 НЕ ПОНРАВИЛИСЬ:")
             for i, idx in enumerate(disliked_book_indices):
-                book = metrics_full.df.iloc[idx]
-                print(f"  {i+1}. '{book['title']}' - {book['author']} ({book['genre']})")
+                print(f"  {i+1}. '{titles[idx]}' - {authors[idx]} ({genres[idx]})")
         print()
     
     # Получаем оценки для ВСЕХ книг в ОТФИЛЬТРОВАННОМ датасете с учетом стратегии
-    if strategy == 'combined':
-        all_scores = _combined_strategy_all_books(metrics_full, metrics_filtered, liked_book_indices, weights, exclude_liked)
-    elif strategy == 'average':
-        all_scores = _average_strategy_all_books(metrics_full, metrics_filtered, liked_book_indices, weights, exclude_liked)
-    elif strategy == 'union':
-        all_scores = _union_strategy_all_books(metrics_full, metrics_filtered, liked_book_indices, weights, exclude_liked)
-    elif strategy == 'content_boost':
-        all_scores = _content_boost_strategy_all_books(metrics_full, metrics_filtered, liked_book_indices, weights, exclude_liked)
-    else:
-        all_scores = _combined_strategy_all_books(metrics_full, metrics_filtered, liked_book_indices, weights, exclude_liked)
+    strategy_function = _STRATEGIES.get(strategy, _combined_strategy_all_books)
+    all_scores, liked_similarity = strategy_function(metrics_full, filtered_to_full, liked_book_indices,
+                                                     weights, exclude_liked)
+    # Анализ рекомендаций использует схожесть с весами по умолчанию
+    if weights is not None:
+        liked_similarity = None
+    disliked_similarity = _similarity_to_books(metrics_full, filtered_to_full, disliked_book_indices)
     
     # Применяем штраф за дизлайки ко ВСЕМ книгам в ОТФИЛЬТРОВАННОМ датасете
     if disliked_book_indices:
-        all_scores = _apply_dislike_penalty_all_books(metrics_full, metrics_filtered, all_scores, disliked_book_indices, penalty_factor)
+        all_scores = _apply_dislike_penalty_all_books(filtered_to_full, all_scores, disliked_similarity,
+                                                      disliked_book_indices, penalty_factor)
     
-    # Сортируем и выбираем лучшие
-    all_recommendations = sorted(all_scores.items(), key=lambda x: x[1], reverse=True)
-    recommendations = all_recommendations[:n_recommendations]
+    # Выбираем лучшие книги по скорректированной оценке
+    recommendations = _top_recommendations(all_scores, n_recommendations)
     
     if verbose:
-        _display_recommendations(metrics_full, metrics_filtered, recommendations, liked_book_indices, disliked_book_indices)
+        _display_recommendations(metrics_full, filtered_to_full, recommendations,
+                                 liked_book_indices, disliked_book_indices, liked_similarity, disliked_similarity)
     
     return recommendations
 
 
-def _apply_dislike_penalty_all_books(metrics_full, metrics_filtered, all_scores, disliked_indices, penalty_factor):
-    """Применяет штраф ко ВСЕМ книгам в отфильтрованном датасете на основе дизлайков из полного датасета"""
-    penalized_scores = {}
+def _top_recommendations(all_scores, n_recommendations):
+    """Выбор n лучших книг без полной сортировки всех оценок (исключенные книги имеют -inf)"""
+    available = np.flatnonzero(all_scores > -np.inf)
+    top = available[top_k_indices(all_scores[available], n_recommendations)]
+    return list(zip(top.tolist(), all_scores[top].tolist()))
+
+
+def _apply_dislike_penalty_all_books(filtered_to_full, all_scores, disliked_similarity, disliked_indices, penalty_factor):
+    """
+    Применяет штраф ко ВСЕМ книгам в отфильтрованном датасете на основе дизлайков из полного датасета
+    disliked_similarity - схожесть книг отфильтрованного датасета с дизлайками (книги x дизлайки)
+    """
+    # Максимальная схожесть каждой книги с дизлайками - одна редукция по срезу матрицы схожести
+    max_dislike_similarity = np.maximum(disliked_similarity.max(axis=1), 0)
     
-    for book_idx, similarity in all_scores.items():
-        if book_idx in disliked_indices:
-            continue  # Полностью исключаем дизлайки
-            
-        # Вычисляем схожесть с дизлайками (из полного датасета)
-        max_dislike_similarity = 0
-        for dislike_idx in disliked_indices:
-            dislike_sim = metrics_full.similarity_score(book_idx, dislike_idx)
-            max_dislike_similarity = max(max_dislike_similarity, dislike_sim)
-        
-        # Применяем штраф
-        penalty = max_dislike_similarity * penalty_factor
-        penalized_similarity = similarity * (1 - penalty)
-        
-        penalized_scores[book_idx] = max(penalized_similarity, 0)
+    # Применяем штраф ко всем неисключенным книгам
+    penalty = max_dislike_similarity * penalty_factor
+    scored = all_scores > -np.inf
+    penalized_scores = np.full_like(all_scores, -np.inf)
+    penalized_scores[scored] = np.maximum(all_scores[scored] * (1 - penalty[scored]), 0)
     
+    # Полностью исключаем дизлайки
+    penalized_scores[_filtered_positions(filtered_to_full, disliked_indices)] = -np.inf
     return penalized_scores
 
 
-def _combined_strategy_all_books(metrics_full, metrics_filtered, liked_indices, weights, exclude_liked):
-    """Комбинированная стратегия для ВСЕХ книг в отфильтрованном датасете"""
-    book_scores = {}
+def _similarity_to_books(metrics_full, filtered_to_full, book_indices, weights=None):
+    """Схожесть книг отфильтрованного датасета с книгами полного датасета - срез матрицы схожести (N x K)"""
+    if metrics_full.weights_key(weights) != metrics_full.weights_key():
+        # Для весов не по умолчанию считаем только нужный блок, а не всю матрицу n x n
+        return 1.0 - metrics_full.distance_block(filtered_to_full, book_indices, weights)
     
-    for book_idx in range(len(metrics_filtered.df)):
-        if exclude_liked and book_idx in liked_indices:
-            continue
-            
-        total_similarity = 0
-        for liked_idx in liked_indices:
-            similarity = metrics_full.similarity_score(book_idx, liked_idx, weights)
-            total_similarity += similarity
-        
-        avg_similarity = total_similarity / len(liked_indices)
-        book_scores[book_idx] = avg_similarity
-    
-    # Усиливаем рекомендации с общими признаками
-    boosted_scores = _boost_by_common_features(metrics_full, metrics_filtered, liked_indices, book_scores)
-    
-    return boosted_scores
+    # Матрица симметрична: копируем K непрерывных строк выбранных книг и берем в них столбцы,
+    # вместо разбросанного по всей матрице выбора N x K элементов
+    return metrics_full.S[book_indices][:, filtered_to_full].T
+
+
+def _filtered_positions(filtered_to_full, full_indices):
+    """
+    Позиции книг полного датасета в отфильтрованном (книги, не прошедшие фильтр, пропускаются).
+    filtered_to_full упорядочен по возрастанию - двоичный поиск по K книгам вместо проверки всех N
+    """
+    full_indices = np.asarray(full_indices, dtype=np.intp)
+    positions = np.searchsorted(filtered_to_full, full_indices)
+    found = positions < len(filtered_to_full)
+    found[found] = filtered_to_full[positions[found]] == full_indices[found]
+    return positions[found]
+
+
+def _exclude_liked(scores, filtered_to_full, liked_indices, exclude_liked):
+    """Исключение понравившихся книг из оценок на месте (оценка -inf), если их нужно исключить"""
+    if exclude_liked:
+        scores[_filtered_positions(filtered_to_full, liked_indices)] = -np.inf
+    return scores
+
+
+def _strategy_scores(metrics_full, liked_indices, weights):
+    """
+    Оценки стратегий для ВСЕХ книг полного датасета (до исключения лайков и штрафа).
+    Результат кэшируется по набору лайков и кортежу весов и не зависит от фильтров
+    """
+    liked_key = tuple(liked_indices)
+    weights_key = metrics_full.weights_key(weights)
+    return metrics_full.cached_result('strategy_scores', (liked_key, weights_key),
+                                      lambda: _compute_strategy_scores(metrics_full, liked_key, weights_key))
+
+
+def _compute_strategy_scores(metrics_full, liked_key, weights_key):
+    """
+    Средняя и максимальная схожесть с лайками за один проход по срезу схожести,
+    усиленная средняя и сам срез (книги x лайки)
+    """
+    all_books = np.arange(len(metrics_full.df))
+    liked_similarity = _similarity_to_books(metrics_full, all_books, list(liked_key),
+                                            metrics_full.weights_from_key(weights_key))
+    average = liked_similarity.mean(axis=1, dtype=np.float64)  # Накопление сразу в float64
+    union = liked_similarity.max(axis=1, initial=0.0).astype(float)  # Не ниже нуля
+    # Множители усиления не зависят от весов: кэшируются по одному кортежу лайков
+    boost = metrics_full.cached_result('common_features_boost', liked_key,
+                                       lambda: _boost_by_common_features(metrics_full, liked_key))
+    boosted = average * boost
+    
+    scores = {'average': average, 'union': union, 'content_boost': boosted, 'liked_similarity': liked_similarity}
+    for array in scores.values():
+        array.setflags(write=False)
+    return scores
+
+
+def _combined_strategy_all_books(metrics_full, filtered_to_full, liked_indices, weights, exclude_liked):
+    """Комбинированная стратегия для ВСЕХ книг в отфильтрованном датасете"""
+    # Средняя схожесть, усиленная общими признаками - то же, что усиление контента
+    return _content_boost_strategy_all_books(metrics_full, filtered_to_full, liked_indices, weights, exclude_liked)
 
 
-def _average_strategy_all_books(metrics_full, metrics_filtered, liked_indices, weights, exclude_liked):
+def _average_strategy_all_books(metrics_full, filtered_to_full, liked_indices, weights, exclude_liked):
     """Стратегия усреднения для ВСЕХ книг в отфильтрованном датасете"""
-    book_scores = {}
-    
-    for book_idx in range(len(metrics_filtered.df)):
-        if exclude_liked and book_idx in liked_indices:
-            continue
-            
-        total_similarity = 0
-        for liked_idx in liked_indices:
-            similarity = metrics_full.similarity_score(book_idx, liked_idx, weights)
-            total_similarity += similarity
-        
-        avg_similarity = total_similarity / len(liked_indices)
-        book_scores[book_idx] = avg_similarity
-    
-    return book_scores
+    scores = _strategy_scores(metrics_full, liked_indices, weights)
+    return (_exclude_liked(scores['average'][filtered_to_full], filtered_to_full, liked_indices, exclude_liked),
+            scores['liked_similarity'][filtered_to_full])
 
 
-def _union_strategy_all_books(metrics_full, metrics_filtered, liked_indices, weights, exclude_liked):
+def _union_strategy_all_books(metrics_full, filtered_to_full, liked_indices, weights, exclude_liked):
     """Стратегия объединения для ВСЕХ книг в отфильтрованном датасете"""
-    max_scores = {}
-    
-    for book_idx in range(len(metrics_filtered.df)):
-        if exclude_liked and book_idx in liked_indices:
-            continue
-            
-        max_similarity = 0
-        for liked_idx in liked_indices:
-            similarity = metrics_full.similarity_score(book_idx, liked_idx, weights)
-            max_similarity = max(max_similarity, similarity)
-        
-        max_scores[book_idx] = max_similarity
-    
-    return max_scores
+    scores = _strategy_scores(metrics_full, liked_indices, weights)
+    return (_exclude_liked(scores['union'][filtered_to_full], filtered_to_full, liked_indices, exclude_liked),
+            scores['liked_similarity'][filtered_to_full])
 
 
-def _content_boost_strategy_all_books(metrics_full, metrics_filtered, liked_indices, weights, exclude_liked):
+def _content_boost_strategy_all_books(metrics_full, filtered_to_full, liked_indices, weights, exclude_liked):
     """Стратегия усиления контента для ВСЕХ книг в отфильтрованном датасете"""
-    base_scores = _average_strategy_all_books(metrics_full, metrics_filtered, liked_indices, weights, exclude_liked)
-    boosted_scores = _boost_by_common_features(metrics_full, metrics_filtered, liked_indices, base_scores)
-    return boosted_scores
+    scores = _strategy_scores(metrics_full, liked_indices, weights)
+    return (_exclude_liked(scores['content_boost'][filtered_to_full], filtered_to_full, liked_indices, exclude_liked),
+            scores['liked_similarity'][filtered_to_full])
 
 
-def _boost_by_common_features(metrics_full, metrics_filtered, liked_indices, book_scores):
-    """Усиление оценок на основе общих признаков с лайками из полного датасета"""
-    boosted_scores = book_scores.copy()
-    
-    liked_books = [metrics_full.df.iloc[idx] for idx in liked_indices]
-    
-    genres = [book['genre'] for book in liked_books]
-    authors = [book['author'] for book in liked_books]
+# Стратегии по имени (неизвестное имя - комбинированная стратегия)
+_STRATEGIES = {
+    'combined': _combined_strategy_all_books,
+    'average': _average_strategy_all_books,
+    'union': _union_strategy_all_books,
+    'content_boost': _content_boost_strategy_all_books,
+}
+
+
+def _liked_feature_summary(metrics_full, liked_indices):
+    """
+    Счетчики и самые частые жанр/автор понравившихся книг в виде целочисленных кодов;
+    код -1 - жанр/автор не указан
+    """
+    # Порядок лайков сохраняется: при равных частотах most_common выбирает первый встреченный
+    liked = list(liked_indices)
     
-    genre_counter = Counter(genres)
-    author_counter = Counter(authors)
+    genre_counter = Counter(metrics_full.genre_codes[liked].tolist())
+    author_counter = Counter(metrics_full._cat['author'][liked].tolist())
     
-    most_common_genre = genre_counter.most_common(1)[0][0] if genre_counter else None
-    most_common_author = author_counter.most_common(1)[0][0] if author_counter else None
+    most_common_genre = genre_counter.most_common(1)[0][0] if genre_counter else -1
+    most_common_author = author_counter.most_common(1)[0][0] if author_counter else -1
     
-    for book_idx in boosted_scores:
-        book = metrics_filtered.df.iloc[book_idx]
-        
-        boost = 1.0
-        
-        if most_common_genre and book['genre'] == most_common_genre:
-            boost *= 1.2
-        
-        if most_common_author and book['author'] == most_common_author:
-            boost *= 1.3
-        
-        matching_genres = sum(1 for liked_genre in genres if liked_genre == book['genre'])
-        if matching_genres > 1:
-            boost *= (1 + 0.15 * matching_genres)
-
-        matching_authors = sum(1 for liked_author in authors if liked_author == book['author'])
-        if matching_authors > 1:
-            boost *= (1 + 0.2 * matching_authors)
-        
-        boosted_scores[book_idx] *= boost
-    
-    return boosted_scores
+    return genre_counter, author_counter, most_common_genre, most_common_author
 
 
-def _display_recommendations(metrics_full, metrics_filtered, recommendations, liked_indices, disliked_indices=None):
-    """Отображение рекомендаций с анализом"""
+def _boost_by_common_features(metrics_full, liked_indices):
+    """
+    Множители усиления оценок всех книг полного датасета на основе общих признаков с лайками
+    (liked_indices - кортеж индексов лайков). Через инвертированные индексы кодов жанров и авторов затрагиваются
+    только книги с жанром или автором из лайков - у остальных множитель 1
+    """
+    genre_counter, author_counter, most_common_genre, most_common_author = _liked_feature_summary(
+        metrics_full, liked_indices)
+    genre_index, author_index = metrics_full.genre_index, metrics_full.author_index
+    n_books = len(metrics_full.df)
+    
+    # Неуказанный жанр/автор (код -1) не совпадает ни с одной книгой
+    most_common_genre_boost = np.ones(n_books)
+    if most_common_genre >= 0:
+        most_common_genre_boost[genre_index[most_common_genre]] = 1.2
+    
+    most_common_author_boost = np.ones(n_books)
+    if most_common_author >= 0:
+        most_common_author_boost[author_index[most_common_author]] = 1.3
+    
+    # Несколько лайков с тем же жанром/автором
+    genre_count_boost = np.ones(n_books)
+    for genre, matching_genres in genre_counter.items():
+        if genre >= 0 and matching_genres > 1:
+            genre_count_boost[genre_index[genre]] = 1 + 0.15 * matching_genres
+    
+    author_count_boost = np.ones(n_books)
+    for author, matching_authors in author_counter.items():
+        if author >= 0 and matching_authors > 1:
+            author_count_boost[author_index[author]] = 1 + 0.2 * matching_authors
+    
+    # Тот же порядок умножения, что и при поочередном применении правил
+    boost = most_common_genre_boost * most_common_author_boost * genre_count_boost * author_count_boost
+    boost.setflags(write=False)
+    return boost
+
+
+def _display_recommendations(metrics_full, filtered_to_full, recommendations, liked_indices,
+                             disliked_indices=None, liked_similarity=None, disliked_similarity=None):
+    """
+    Отображение рекомендаций с анализом
+    liked_similarity / disliked_similarity - схожесть книг отфильтрованного датасета с лайками и дизлайками,
+    посчитанная при ранжировании
+    """
     if disliked_indices is None:
         disliked_indices = []
+    if liked_similarity is None:
+        liked_similarity = _similarity_to_books(metrics_full, filtered_to_full, liked_indices)
+    if disliked_similarity is None:
+        disliked_similarity = _similarity_to_books(metrics_full, filtered_to_full, disliked_indices)
         
     print("ТОП РЕКОМЕНДАЦИЙ:")
     print("-" * 70)
@@ -732,28 +849,26 @@ def _display_recommendations(metrics_full, metrics_filtered, recommendations, li
         print("Не найдено подходящих рекомендаций с учетом ваших предпочтений")
         return
     
+    # Столбцы полного датасета как массивы; книги отфильтрованного датасета - через filtered_to_full.
+    # Признаки лайков не зависят от рекомендации - выбираем их один раз до цикла
+    col = metrics_full._col
+    titles, authors, genres, years, pages = col['title'], col['author'], col['genre'], col['year'], col['pages']
+    liked_titles = titles[liked_indices].tolist()
+    liked_features = list(zip(genres[liked_indices].tolist(), authors[liked_indices].tolist()))
+    
     for i, (book_idx, similarity) in enumerate(recommendations, 1):
-        book = metrics_filtered.df.iloc[book_idx]
+        book_full = filtered_to_full[book_idx]
+        book_genre, book_author = genres[book_full], authors[book_full]
         
-        # Находим наиболее похожие книги из лайков (из полного датасета)
-        best_matches = []
-        for liked_idx in liked_indices:
-            liked_book = metrics_full.df.iloc[liked_idx]
-            sim = metrics_full.similarity_score(book_idx, liked_idx)
-            best_matches.append((liked_book['title'], sim))
-        
-        best_matches.sort(key=lambda x: x[1], reverse=True)
-        top_match = best_matches[0] if best_matches else ("", 0)
+        # Наиболее похожая книга из лайков (из полного датасета) - первая с максимальной схожестью
+        best_match = int(np.argmax(liked_similarity[book_idx]))
+        top_match = (liked_titles[best_match], liked_similarity[book_idx, best_match])
         
         # Проверяем схожесть с дизлайками (из полного датасета)
-        max_dislike_similarity = 0
-        if disliked_indices:
-            for dislike_idx in disliked_indices:
-                dislike_sim = metrics_full.similarity_score(book_idx, dislike_idx)
-                max_dislike_similarity = max(max_dislike_similarity, dislike_sim)
-        
-        print(f"{i}. {book['title']} - {book['author']}")
-        print(f"   Жанр: {book['genre']}, Год: {book['year']}, Страниц: {book['pages']}")
+        max_dislike_similarity = disliked_similarity[book_idx].max(initial=0.0)
+        
+        print(f"{i}. {titles[book_full]} - {book_author}")
+        print(f"   Жанр: {book_genre}, Год: {years[book_full]}, Страниц: {pages[book_full]}")
         print(f"   Общая схожесть: {similarity:.3f}")
         
         if top_match[1] > 0:
@@ -764,12 +879,11 @@ def _display_recommendations(metrics_full, metrics_filtered, recommendations, li
         
         # Показываем общие черты с понравившимися книгами (из полного датасета)
         common_features = []
-        for liked_idx in liked_indices:
-            liked_book = metrics_full.df.iloc[liked_idx]
-            if book['genre'] == liked_book['genre']:
-                common_features.append(f"жанр '{liked_book['genre']}'")
-            if book['author'] == liked_book['author']:
-                common_features.append(f"автор {liked_book['author']}")
+        for liked_genre, liked_author in liked_features:
+            if book_genre == liked_genre:
+                common_features.append(f"жанр '{liked_genre}'")
+            if book_author == liked_author:
+                common_features.append(f"автор {liked_author}")
         
         if common_features:
             print(f"   ✅ Общие черты: {', '.join(set(common_features))}")
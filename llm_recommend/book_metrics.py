@@ -12,6 +12,7 @@ class BookDistanceMetrics:
         self._setup_taxonomy_tree()
         self._setup_scalers()
         self.numerical_features = ['year', 'pages']
+        self._setup_feature_arrays()
     
     def _setup_taxonomy_tree(self):
         """Иерархия жанров в виде дерева"""
@@ -78,6 +79,40 @@ class BookDistanceMetrics:
         pages = self.df['pages'].values.reshape(-1, 1)
         self.scalers['pages'] = MinMaxScaler().fit(pages)
     
+    def _setup_feature_arrays(self):
+        """Признаки всех книг в виде массивов для векторных вычислений расстояний"""
+        # Нормализованные числовые признаки (n x len(numerical_features))
+        self.numerical_matrix = np.column_stack([
+            self.scalers[feature].transform(self.df[feature].values.reshape(-1, 1))[:, 0]
+            for feature in self.numerical_features
+        ])
+        
+        # Коды жанров и таблица таксономических расстояний между ними.
+        # Последняя строка/столбец - пропущенный жанр (код -1)
+        self.genre_codes, genres = pd.factorize(self.df['genre'])
+        self.genre_dist_table = np.ones((len(genres) + 1, len(genres) + 1))
+        for i, genre1 in enumerate(genres):
+            for j, genre2 in enumerate(genres):
+                self.genre_dist_table[i, j] = self.taxonomic_distance(genre1, genre2)
+        
+        # Коды категориальных и бинарных признаков (-1 - пропуск, не равен ничему)
+        self.category_codes = {
+            feature: pd.factorize(self.df[feature])[0]
+            for feature in ('author', 'publisher', 'language', 'has_illustrations')
+        }
+        
+        # Инвертированный индекс: значение жанра/автора -> позиции книг с ним
+        self.positions_by_value = {
+            feature: self.df.groupby(feature, sort=False, observed=True).indices
+            for feature in ('genre', 'author')
+        }
+    
+    def _category_mismatch(self, feature, book_idx):
+        """Расстояние по категориальному признаку от книги book_idx до всех книг"""
+        codes = self.category_codes[feature]
+        code = codes[book_idx]
+        return ((codes != code) | (code < 0)).astype(float)
+    
     def _get_genre_path(self, genre):
         """Получить путь жанра в дереве"""
         return self.genre_mapping.get(genre, '')
@@ -131,9 +166,7 @@ class BookDistanceMetrics:
     
     def manhattan_distance(self, i, j):
         """Манхэттенское расстояние"""
-        vec1 = self.get_numerical_vector(i)
-        vec2 = self.get_numerical_vector(j)
-        return np.sum(np.abs(vec1 - vec2))
+        return np.sum(np.abs(self.numerical_matrix[i] - self.numerical_matrix[j]))
     
     def categorical_distance(self, val1, val2):
         """Расстояние для категориальных признаков"""
@@ -149,34 +182,41 @@ class BookDistanceMetrics:
         """
         if weights is None:
             weights = Config.DEFAULT_WEIGHTS
-
-        book1 = self.df.iloc[book1_idx]
-        book2 = self.df.iloc[book2_idx]
         
         total_distance = 0.0
         
         # Таксономическое расстояние по жанру
-        genre_dist = self.taxonomic_distance(book1['genre'], book2['genre'])
+        genre_dist = self.genre_dist_table[self.genre_codes[book1_idx], self.genre_codes[book2_idx]]
         total_distance += weights['genre'] * genre_dist
         
         # Числовые признаки
         numerical_dist = self.manhattan_distance(book1_idx, book2_idx)
         total_distance += weights['numerical'] * numerical_dist
         
-        # Категориальные признаки
-        author_dist = self.categorical_distance(book1['author'], book2['author'])
-        total_distance += weights['author'] * author_dist
+        # Категориальные и бинарные признаки
+        for feature in ('author', 'publisher', 'language', 'has_illustrations'):
+            code1 = self.category_codes[feature][book1_idx]
+            code2 = self.category_codes[feature][book2_idx]
+            feature_dist = 0.0 if code1 == code2 and code1 >= 0 else 1.0
+            total_distance += weights[feature] * feature_dist
+
+        return total_distance
+    
+    def distance_to(self, book_idx, weights=None):
+        """
+        Композитные расстояния от книги book_idx до всех книг датасета (массив длины n)
+        """
+        if weights is None:
+            weights = Config.DEFAULT_WEIGHTS
         
-        publisher_dist = self.categorical_distance(book1['publisher'], book2['publisher'])
-        total_distance += weights['publisher'] * publisher_dist
+        total_distance = weights['genre'] * self.genre_dist_table[self.genre_codes[book_idx], self.genre_codes]
+        
+        numerical_dist = np.abs(self.numerical_matrix - self.numerical_matrix[book_idx]).sum(axis=1)
+        total_distance += weights['numerical'] * numerical_dist
+        
+        for feature in ('author', 'publisher', 'language', 'has_illustrations'):
+            total_distance += weights[feature] * self._category_mismatch(feature, book_idx)
         
-        language_dist = self.categorical_distance(book1['language'], book2['language'])
-        total_distance += weights['language'] * language_dist
-
-        # Бинарные признаки
-        ill_dist = self.bin_distance(book1['has_illustrations'], book2['has_illustrations'])
-        total_distance += weights['has_illustrations'] * ill_dist
-
         return total_distance
     
     def similarity_score(self, book1_idx, book2_idx, weights=None):
@@ -186,29 +226,27 @@ class BookDistanceMetrics:
         distance = self.composite_distance(book1_idx, book2_idx, weights)
         return 1.0 - distance
     
+    def similarity_to(self, book_idx, weights=None):
+        """
+        Схожесть книги book_idx со всеми книгами датасета (1 - distance)
+        """
+        return 1.0 - self.distance_to(book_idx, weights)
+    
     def get_similar_books(self, book_idx, n=5, weights=None):
         """
         Найти n наиболее похожих книг
         """
-        similarities = []
+        similarities = self.similarity_to(book_idx, weights)
         
-        for i in range(len(self.df)):
-            if i != book_idx:
-                sim = self.similarity_score(book_idx, i, weights)
-                similarities.append((i, sim))
-        
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        return similarities[:n]
+        # Стабильная сортировка: при равной схожести раньше идет меньший индекс
+        order = np.argsort(-similarities, kind='stable')
+        order = order[order != book_idx][:n]
+        return [(int(i), similarities[i]) for i in order]
     
     def create_distance_matrix(self, weights=None):
         """Создание матрицы расстояний между всеми книгами"""
         n = len(self.df)
-        distance_matrix = np.zeros((n, n))
-
-        for i in range(n):
-            for j in range(i + 1, n):
-                dist = self.composite_distance(i, j, weights)
-                distance_matrix[i, j] = dist
-                distance_matrix[j, i] = dist
+        distance_matrix = np.array([self.distance_to(i, weights) for i in range(n)]).reshape(n, n)
+        np.fill_diagonal(distance_matrix, 0.0)
 
         return distance_matrix
\ No newline at end of file
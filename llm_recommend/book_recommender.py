@@ -7,6 +7,9 @@ from typing import List, Tuple, Dict, Any
 from collections import Counter
 from config import Config
 
+# Пустой список позиций для значений, которых нет среди книг
+NO_POSITIONS = np.empty(0, dtype=np.intp)
+
 class BookRecommender:
     def __init__(self, metrics_full, metrics_filtered=None):
         """
@@ -55,19 +58,15 @@ class BookRecommender:
         if disliked_indices:
             all_scores = self._apply_dislike_penalty(all_scores, disliked_indices, penalty_factor)
         
-        # Исключаем лайки из рекомендаций
-        for idx in liked_indices:
-            if idx in all_scores:
-                del all_scores[idx]
-        
-        # Исключаем дизлайки из рекомендаций
-        for idx in disliked_indices:
-            if idx in all_scores:
-                del all_scores[idx]
+        # Исключаем лайки и дизлайки из рекомендаций одной маской
+        candidates = np.ones(len(all_scores), dtype=bool)
+        excluded = [idx for idx in set(liked_indices).union(disliked_indices) if idx < len(all_scores)]
+        candidates[excluded] = False
         
-        # Сортируем и выбираем лучшие
-        recommendations = sorted(all_scores.items(), key=lambda x: x[1], reverse=True)
-        return recommendations[:n_recommendations]
+        # Устойчивая сортировка: при равных оценках книги идут в порядке датасета
+        positions = np.flatnonzero(candidates)
+        best = positions[np.argsort(-all_scores[positions], kind='stable')[:n_recommendations]]
+        return [(int(book_idx), all_scores[book_idx]) for book_idx in best]
     
     def recommend_for_book(self, book_idx: int, n_recommendations: int = 5,
                           weights: Dict[str, float] = None) -> List[Tuple[int, float]]:
@@ -145,101 +144,59 @@ class BookRecommender:
             }
         }
     
-    def _combined_strategy(self, liked_indices: List[int], weights: Dict[str, float]) -> Dict[int, float]:
+    def _similarity_rows(self, book_indices: List[int], weights: Dict[str, float] = None) -> List[np.ndarray]:
+        """
+        Схожесть каждой книги из book_indices (полный датасет) со всеми книгами
+        отфильтрованного датасета: по одному векторному проходу на книгу
+        """
+        n_books = len(self.metrics_filtered.df)
+        return [self.metrics_full.similarity_to(idx, weights)[:n_books] for idx in book_indices]
+    
+    def _combined_strategy(self, liked_indices: List[int], weights: Dict[str, float]) -> np.ndarray:
         """Комбинированная стратегия"""
-        book_scores = {}
-        
-        for book_idx in range(len(self.metrics_filtered.df)):
-            # Проверяем, не является ли книга уже понравившейся
-            if book_idx in liked_indices:
-                continue
-                
-            total_similarity = 0
-            for liked_idx in liked_indices:
-                similarity = self.metrics_full.similarity_score(book_idx, liked_idx, weights)
-                total_similarity += similarity
-            
-            avg_similarity = total_similarity / len(liked_indices)
-            book_scores[book_idx] = avg_similarity
+        book_scores = self._average_strategy(liked_indices, weights)
         
         # Усиливаем рекомендации с общими признаками
         return self._boost_by_common_features(liked_indices, book_scores)
     
-    def _average_strategy(self, liked_indices: List[int], weights: Dict[str, float]) -> Dict[int, float]:
+    def _average_strategy(self, liked_indices: List[int], weights: Dict[str, float]) -> np.ndarray:
         """Стратегия усреднения"""
-        book_scores = {}
+        total_similarity = np.zeros(len(self.metrics_filtered.df))
+        for similarity in self._similarity_rows(liked_indices, weights):
+            total_similarity += similarity
         
-        for book_idx in range(len(self.metrics_filtered.df)):
-            # Проверяем, не является ли книга уже понравившейся
-            if book_idx in liked_indices:
-                continue
-                
-            total_similarity = 0
-            for liked_idx in liked_indices:
-                similarity = self.metrics_full.similarity_score(book_idx, liked_idx, weights)
-                total_similarity += similarity
-            
-            avg_similarity = total_similarity / len(liked_indices)
-            book_scores[book_idx] = avg_similarity
-        
-        return book_scores
+        return total_similarity / len(liked_indices)
     
-    def _union_strategy(self, liked_indices: List[int], weights: Dict[str, float]) -> Dict[int, float]:
+    def _union_strategy(self, liked_indices: List[int], weights: Dict[str, float]) -> np.ndarray:
         """Стратегия объединения"""
-        max_scores = {}
-        
-        for book_idx in range(len(self.metrics_filtered.df)):
-            # Проверяем, не является ли книга уже понравившейся
-            if book_idx in liked_indices:
-                continue
-                
-            max_similarity = 0
-            for liked_idx in liked_indices:
-                similarity = self.metrics_full.similarity_score(book_idx, liked_idx, weights)
-                max_similarity = max(max_similarity, similarity)
-            
-            max_scores[book_idx] = max_similarity
+        max_similarity = np.zeros(len(self.metrics_filtered.df))
+        for similarity in self._similarity_rows(liked_indices, weights):
+            np.maximum(max_similarity, similarity, out=max_similarity)
         
-        return max_scores
+        return max_similarity
     
-    def _content_boost_strategy(self, liked_indices: List[int], weights: Dict[str, float]) -> Dict[int, float]:
+    def _content_boost_strategy(self, liked_indices: List[int], weights: Dict[str, float]) -> np.ndarray:
         """Стратегия усиления контента"""
         base_scores = self._average_strategy(liked_indices, weights)
         return self._boost_by_common_features(liked_indices, base_scores)
     
-    def _apply_dislike_penalty(self, all_scores: Dict[int, float], disliked_indices: List[int],
-                              penalty_factor: float) -> Dict[int, float]:
+    def _apply_dislike_penalty(self, all_scores: np.ndarray, disliked_indices: List[int],
+                              penalty_factor: float) -> np.ndarray:
         """Применение штрафа за дизлайки"""
-        penalized_scores = {}
-        
-        for book_idx, similarity in all_scores.items():
-            # Проверяем, не является ли книга уже непонравившейся
-            if book_idx in disliked_indices:
-                continue
-                
-            # Вычисляем схожесть с дизлайками
-            max_dislike_similarity = 0
-            for dislike_idx in disliked_indices:
-                dislike_sim = self.metrics_full.similarity_score(book_idx, dislike_idx)
-                max_dislike_similarity = max(max_dislike_similarity, dislike_sim)
-            
-            # Применяем штраф
-            penalty = max_dislike_similarity * penalty_factor
-            penalized_similarity = similarity * (1 - penalty)
-            
-            penalized_scores[book_idx] = max(penalized_similarity, 0)
-        
-        return penalized_scores
+        # Максимальная схожесть каждой книги с дизлайками
+        max_dislike_similarity = np.zeros(len(self.metrics_filtered.df))
+        for dislike_sim in self._similarity_rows(disliked_indices):
+            np.maximum(max_dislike_similarity, dislike_sim, out=max_dislike_similarity)
+        
+        # Применяем штраф (сами дизлайки исключаются из рекомендаций позже)
+        penalty = max_dislike_similarity * penalty_factor
+        return np.maximum(all_scores * (1 - penalty), 0)
     
-    def _boost_by_common_features(self, liked_indices: List[int], book_scores: Dict[int, float]) -> Dict[int, float]:
+    def _boost_by_common_features(self, liked_indices: List[int], book_scores: np.ndarray) -> np.ndarray:
         """Усиление оценок на основе общих признаков"""
-        boosted_scores = book_scores.copy()
-        
         # Анализируем общие черты понравившихся книг
-        liked_books = [self.metrics_full.df.iloc[idx] for idx in liked_indices]
-        
-        genres = [book['genre'] for book in liked_books]
-        authors = [book['author'] for book in liked_books]
+        genres = self.metrics_full.df['genre'].to_numpy()[liked_indices].tolist()
+        authors = self.metrics_full.df['author'].to_numpy()[liked_indices].tolist()
         
         genre_counter = Counter(genres)
         author_counter = Counter(authors)
@@ -247,37 +204,30 @@ class BookRecommender:
         most_common_genre = genre_counter.most_common(1)[0][0] if genre_counter else None
         most_common_author = author_counter.most_common(1)[0][0] if author_counter else None
         
-        # Усиливаем книги с общими признаками
-        for book_idx in boosted_scores:
-            # Пропускаем книги, которые уже в лайках
-            if book_idx in liked_indices:
-                continue
-                
-            book = self.metrics_filtered.df.iloc[book_idx]
-            
-            boost = 1.0
-            
-            # Усиление за общий жанр
-            if most_common_genre and book['genre'] == most_common_genre:
-                boost *= 1.2
-            
-            # Усиление за общего автора
-            if most_common_author and book['author'] == most_common_author:
-                boost *= 1.3
-            
-            # Усиление за множественные совпадения жанров
-            matching_genres = sum(1 for liked_genre in genres if liked_genre == book['genre'])
+        # Множители усиления по спискам позиций книг, а не по каждой книге
+        positions = self.metrics_filtered.positions_by_value
+        boost = np.ones(len(self.metrics_filtered.df))
+        
+        # Усиление за общий жанр
+        if most_common_genre:
+            boost[positions['genre'].get(most_common_genre, NO_POSITIONS)] *= 1.2
+        
+        # Усиление за общего автора
+        if most_common_author:
+            boost[positions['author'].get(most_common_author, NO_POSITIONS)] *= 1.3
+        
+        # Усиление за множественные совпадения жанров
+        for genre, matching_genres in genre_counter.items():
             if matching_genres > 1:
-                boost *= (1 + 0.15 * matching_genres)
-
-            # Усиление за множественные совпадения автора
-            matching_authors = sum(1 for liked_author in authors if liked_author == book['author'])
+                boost[positions['genre'].get(genre, NO_POSITIONS)] *= (1 + 0.15 * matching_genres)
+        
+        # Усиление за множественные совпадения автора
+        for author, matching_authors in author_counter.items():
             if matching_authors > 1:
-                boost *= (1 + 0.2 * matching_authors)
-            
-            boosted_scores[book_idx] *= boost
+                boost[positions['author'].get(author, NO_POSITIONS)] *= (1 + 0.2 * matching_authors)
         
-        return boosted_scores
+        # Усиливаем книги с общими признаками (лайки исключаются из рекомендаций позже)
+        return book_scores * boost
     
     def format_recommendations(self, recommendations: List[Tuple[int, float]],
                               liked_indices: List[int] = None,
@@ -293,9 +243,13 @@ class BookRecommender:
         output.append("РЕКОМЕНДАЦИИ:")
         output.append("=" * 70)
         
-        for i, (book_idx, similarity) in enumerate(recommendations, 1):
-            book = self.metrics_filtered.df.iloc[book_idx]
-            
+        # Строки книг выбираем одной выборкой, а не iloc на каждой итерации
+        rec_books = self.metrics_filtered.df.iloc[
+            [book_idx for book_idx, _ in recommendations]
+        ].to_dict(orient='records')
+        liked_books = self.metrics_full.df.iloc[liked_indices or []].to_dict(orient='records')
+        
+        for i, ((book_idx, similarity), book) in enumerate(zip(recommendations, rec_books), 1):
             output.append(f"{i}. {book['title']} - {book['author']}")
             output.append(f"   Жанр: {book['genre']}, Год: {book['year']}, Страниц: {book['pages']}")
             output.append(f"   Схожесть: {similarity:.3f}")
@@ -304,11 +258,11 @@ class BookRecommender:
             if liked_indices:
                 best_match = None
                 best_similarity = 0
-                for liked_idx in liked_indices:
+                for liked_idx, liked_book in zip(liked_indices, liked_books):
                     sim = self.metrics_full.similarity_score(book_idx, liked_idx)
                     if sim > best_similarity:
                         best_similarity = sim
-                        best_match = self.metrics_full.df.iloc[liked_idx]
+                        best_match = liked_book
                 
                 if best_match is not None and best_similarity > 0.3:
                     output.append(f"   Похожа на: '{best_match['title']}' (схожесть: {best_similarity:.3f})")
@@ -316,15 +270,14 @@ class BookRecommender:
             # Проверяем общие черты
             if liked_indices:
                 common_features = []
-                for liked_idx in liked_indices:
-                    liked_book = self.metrics_full.df.iloc[liked_idx]
+                for liked_book in liked_books:
                     if book['genre'] == liked_book['genre']:
                         common_features.append(f"жанр '{liked_book['genre']}'")
                     if book['author'] == liked_book['author']:
                         common_features.append(f"автор {liked_book['author']}")
                 
                 if common_features:
-                    output.append(f"   Общие черты: {', '.join(set(common_features))}")
+                    output.append(f"   Общие черты: {', '.join(dict.fromkeys(common_features))}")
             
             output.append("")
         
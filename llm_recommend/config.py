@@ -11,6 +11,10 @@ class Config:
     NEURAL_URL = "http://localhost:11434"
     NEURAL_MODEL = "llama3.1:8b-instruct-q4_0"
     NEURAL_TIMEOUT = 250
+    # Сколько модель остается загруженной в памяти Ollama после запроса
+    NEURAL_KEEP_ALIVE = "30m"
+    # Сколько последних ответов нейросети хранить в кэше
+    NEURAL_CACHE_SIZE = 256
     
     # Настройки метрик
     DEFAULT_WEIGHTS = {
@@ -32,4 +36,6 @@ class Config:
     
     # Настройки фильтрации
     MAX_RESULTS = 100
+    # Сколько последних результатов фильтрации хранить в кэше
+    FILTER_CACHE_SIZE = 64
     SIMILARITY_THRESHOLD = 0.3
\ No newline at end of file
@@ -1,21 +1,68 @@
 """
 Загрузка и подготовка данных
 """
+import re
 import pandas as pd
 import numpy as np
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Optional
 
+# Узкие типы столбцов датасета: числа и строки с небольшим числом значений
+BOOK_DTYPES = {'year': 'int16', 'pages': 'int32', 'age_restriction': 'int8', 'has_illustrations': 'bool',
+               'author': 'category', 'publisher': 'category', 'language': 'category'}
+
+# Сколько последних поисков книг по названию (и их шаблонов) хранить в кэше
+TITLE_LOOKUP_CACHE_SIZE = 1024
+
+# Числовые столбцы, по которым фильтруются книги
+NUMERIC_FILTER_COLUMNS = ('year', 'pages', 'has_illustrations')
+
+# Столбцы, по которым идет поиск книг по тексту
+SEARCH_COLUMNS = ('title', 'author')
+
+# Символы, при которых строку поиска нужно разбирать как регулярное выражение
+REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+
+@lru_cache(maxsize=TITLE_LOOKUP_CACHE_SIZE)
+def _search_pattern(text: str) -> re.Pattern:
+    """Скомпилированный шаблон поиска без учета регистра (кэшируется между запросами)"""
+    return re.compile(text, re.IGNORECASE)
+
+
 class BookDataLoader:
     def __init__(self, data_path: str):
         self.data_path = data_path
         self.df = None
         self.filtered_df = None
+        # Позиции книг filtered_df в df (None - фильтры не применялись)
+        self._filtered_positions = None
+        # Кэш поиска: (название, автор) -> позиция книги или None
+        self._title_lookup = OrderedDict()
+        # Столбцы поиска в нижнем регистре (считаются один раз при загрузке)
+        self._lower = {}
+        # Индекс точных названий: название в нижнем регистре -> первая позиция
+        self._title_index = {}
+        # Массивы NumPy числовых столбцов для фильтрации без индексации pandas
+        self._values = {}
         
     def load_data(self) -> pd.DataFrame:
         """Загрузка данных из CSV файла"""
         try:
-            self.df = pd.read_csv(self.data_path)
-            self.filtered_df = self.df.copy()
+            df = pd.read_csv(self.data_path)
+            # Столбцы с пропусками остаются в исходном типе: NaN не помещается в int/bool
+            self.df = df.astype({column: dtype for column, dtype in BOOK_DTYPES.items()
+                                 if dtype == 'category' or df[column].notna().all()})
+            self.filtered_df = self.df
+            self._filtered_positions = None
+            self._title_lookup = OrderedDict()
+            self._values = {c: self.df[c].to_numpy() for c in NUMERIC_FILTER_COLUMNS}
+            self._lower = {c: self.df[c].str.lower() for c in SEARCH_COLUMNS}
+            self._title_index = {}
+            for position, title in enumerate(self._lower['title'].tolist()):
+                if isinstance(title, str):
+                    self._title_index.setdefault(title, position)
             print(f"✅ Данные загружены: {len(self.df)} книг")
             return self.df
         except Exception as e:
@@ -40,77 +87,131 @@ class BookDataLoader:
                     'has_illustrations': True
                 }
         """
+        return self.take_books(self.filter_positions(filter_criteria))
+    
+    def filter_positions(self, filter_criteria: dict) -> np.ndarray:
+        """Позиции книг в df, подходящих под критерии (формат критериев - как в filter_books)"""
         if self.df is None:
             raise ValueError("Данные не загружены")
             
-        filtered = self.df.copy()
+        df = self.df
+        values = self._values
+        # Одна общая маска вместо копии DataFrame на каждый фильтр
+        mask = np.ones(len(df), dtype=bool)
         
         # Фильтр по жанру
         if 'genre' in filter_criteria and filter_criteria['genre']:
             genres = [g for g in filter_criteria['genre'] if g]
             if genres:
-                filtered = filtered[filtered['genre'].isin(genres)]
+                mask &= df['genre'].isin(genres).to_numpy()
         
         # Фильтр по автору
         if 'author' in filter_criteria and filter_criteria['author']:
             authors = [a for a in filter_criteria['author'] if a]
             if authors:
-                filtered = filtered[filtered['author'].isin(authors)]
+                mask &= df['author'].isin(authors).to_numpy()
         
         # Фильтр по году
         if 'year_from' in filter_criteria and filter_criteria['year_from']:
-            filtered = filtered[filtered['year'] >= filter_criteria['year_from']]
+            mask &= values['year'] >= filter_criteria['year_from']
         if 'year_to' in filter_criteria and filter_criteria['year_to']:
-            filtered = filtered[filtered['year'] <= filter_criteria['year_to']]
+            mask &= values['year'] <= filter_criteria['year_to']
         
         # Фильтр по страницам
         if 'pages_from' in filter_criteria and filter_criteria['pages_from']:
-            filtered = filtered[filtered['pages'] >= filter_criteria['pages_from']]
+            mask &= values['pages'] >= filter_criteria['pages_from']
         if 'pages_to' in filter_criteria and filter_criteria['pages_to']:
-            filtered = filtered[filtered['pages'] <= filter_criteria['pages_to']]
+            mask &= values['pages'] <= filter_criteria['pages_to']
         
         # Фильтр по языку
         if 'language' in filter_criteria and filter_criteria['language']:
             languages = [l for l in filter_criteria['language'] if l]
             if languages:
-                filtered = filtered[filtered['language'].isin(languages)]
+                mask &= df['language'].isin(languages).to_numpy()
         
         # Фильтр по иллюстрациям
         if 'has_illustrations' in filter_criteria:
             has_ill = filter_criteria['has_illustrations']
             if has_ill == "Есть" or has_ill is True:
-                filtered = filtered[filtered['has_illustrations'] == 1]
+                mask &= values['has_illustrations'] == 1
             elif has_ill == "Нет" or has_ill is False:
-                filtered = filtered[filtered['has_illustrations'] == 0]
+                mask &= values['has_illustrations'] == 0
         
-        self.filtered_df = filtered.reset_index(drop=True)
+        return np.flatnonzero(mask)
+    
+    def take_books(self, positions: np.ndarray) -> pd.DataFrame:
+        """Книги df на позициях positions становятся текущим отфильтрованным набором"""
+        if len(positions) == len(self.df):
+            # Без отсеянных строк срез не нужен: отдаем общий DataFrame без копии
+            self.filtered_df = self.df
+        elif not np.array_equal(positions, self._filtered_positions):
+            # Тот же набор книг, что и текущий, повторно не копируем
+            self.filtered_df = self.df.iloc[positions].reset_index(drop=True)
+        self._filtered_positions = positions
         print(f"✅ Отфильтровано: {len(self.filtered_df)} книг")
         return self.filtered_df
     
     def reset_filters(self):
         """Сброс фильтров"""
-        self.filtered_df = self.df.copy()
+        self.filtered_df = self.df
+        self._filtered_positions = None
         return self.filtered_df
     
     def get_book_by_title_author(self, title: str, author: str = None) -> Optional[pd.Series]:
         """Поиск книги по названию и автору"""
+        position = self._book_position(title, author)
+        if position is not None:
+            return self.df.iloc[position]
+        return None
+    
+    def _book_position(self, title: str, author: str = None) -> Optional[int]:
+        """Позиция книги по названию и автору с запоминанием результата"""
+        key = (title, author)
+        if key in self._title_lookup:
+            self._title_lookup.move_to_end(key)
+            return self._title_lookup[key]
+        
+        position = self._find_book_position(title, author)
+        self._title_lookup[key] = position
+        # Кэш ограничен: вытесняем самые давно использованные запросы
+        if len(self._title_lookup) > TITLE_LOOKUP_CACHE_SIZE:
+            self._title_lookup.popitem(last=False)
+        return position
+    
+    def _find_book_position(self, title: str, author: str = None) -> Optional[int]:
+        """Позиция первой книги, подходящей по названию и автору"""
+        # Книга с точно таким названием ограничивает поиск строками до нее
+        stop = None
+        if REGEX_SPECIAL_CHARS.isdisjoint(title):
+            stop = self._title_index.get(title.lower())
+        if stop is not None and author and not self._column_contains('author', author, stop + 1)[stop]:
+            stop = None
+        stop = len(self.df) if stop is None else stop + 1
+        
+        mask = self._column_contains('title', title, stop)
         if author:
-            mask = (self.df['title'].str.contains(title, case=False, na=False)) & \
-                   (self.df['author'].str.contains(author, case=False, na=False))
-        else:
-            mask = self.df['title'].str.contains(title, case=False, na=False)
+            mask = mask & self._column_contains('author', author, stop)
         
-        results = self.df[mask]
-        if len(results) > 0:
-            return results.iloc[0]
+        positions = np.flatnonzero(mask)
+        if len(positions) > 0:
+            return int(positions[0])
         return None
     
+    def _column_contains(self, column: str, text: str, stop: int = None) -> np.ndarray:
+        """Маска первых stop строк, в которых столбец содержит текст (без учета регистра)"""
+        if REGEX_SPECIAL_CHARS.isdisjoint(text):
+            # Обычная строка: сравнение подстроки с заранее приведенным столбцом
+            mask = self._lower[column].iloc[:stop].str.contains(text.lower(), regex=False, na=False)
+        else:
+            mask = self.df[column].iloc[:stop].str.contains(_search_pattern(text), na=False)
+        return mask.to_numpy(dtype=bool)
+    
     def get_book_indices_by_titles(self, titles: list, authors: list = None) -> list:
-        """Получение индексов книг по названиям"""
+        """Получение индексов книг по названиям (без построения строк DataFrame)"""
         indices = []
         for i, title in enumerate(titles):
             author = authors[i] if authors and i < len(authors) else None
-            book = self.get_book_by_title_author(title, author)
-            if book is not None:
-                indices.append(book.name)
+            position = self._book_position(title, author)
+            if position is not None:
+                indices.append(position)
         return indices
\ No newline at end of file
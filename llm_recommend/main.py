@@ -2,13 +2,13 @@
 Главный модуль системы рекомендаций книг с поддержкой истории
 """
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any
 from config import Config
 from data_loader import BookDataLoader
 from neural_parser import NeuralBookParser
 from query_processor import QueryProcessor
 from book_recommender import BookRecommender
-from book_metrics import BookDistanceMetrics
 
 class BookRecommendationSystem:
     def __init__(self):
@@ -17,6 +17,14 @@ class BookRecommendationSystem:
         self.query_processor = None
         self.recommender = None
         self.initialized = False
+        # Обработчики данных результата по типу запроса
+        self._result_handlers = {
+            "recommendation": self._handle_recommendation,
+            "search": self._handle_filtered_books,  # Убрали general
+            "comparison": self._handle_comparison,
+            "step_back": self._handle_step_back,
+            "reset": self._handle_filtered_books,
+        }
         
     def initialize(self) -> bool:
         """Инициализация системы"""
@@ -25,33 +33,42 @@ class BookRecommendationSystem:
             print("📚 СИСТЕМА РЕКОМЕНДАЦИЙ КНИГ С ИСТОРИЕЙ")
             print("=" * 60)
             
-            # 1. Инициализация нейросети
-            print("\n🧠 ИНИЦИАЛИЗАЦИЯ НЕЙРОСЕТИ...")
+            # 1. Инициализация нейросети в фоне: загрузка модели идет
+            # параллельно с загрузкой данных и построением метрик.
+            # Ее сообщения копятся в буфере и печатаются после завершения
             self.neural_parser = NeuralBookParser()
-            if not self.neural_parser.initialize():
-                print("❌ Ошибка инициализации нейросети")
-                return False
-            
-            # 2. Загрузка данных
-            print("\n📊 ЗАГРУЗКА ДАННЫХ...")
-            self.data_loader = BookDataLoader(Config.DATA_PATH)
-            self.data_loader.load_data()
-            
-            # 3. Инициализация обработчика запросов с историей
-            print("\n⚙️ ИНИЦИАЛИЗАЦИЯ ОБРАБОТЧИКА С ИСТОРИЕЙ...")
-            self.query_processor = QueryProcessor(self.data_loader)
-            self.query_processor.initialize_metrics()
-            
-            # 4. Инициализация рекомендательной системы
-            print("\n🎯 ИНИЦИАЛИЗАЦИЯ РЕКОМЕНДАТЕЛЬНОЙ СИСТЕМЫ...")
-            self.recommender = BookRecommender(
-                self.query_processor.metrics_full,
-                self.query_processor.metrics_filtered
-            )
+            neural_status = []
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                neural_ready = executor.submit(self.neural_parser.initialize, neural_status)
+                
+                # 2. Загрузка данных
+                print("\n📊 ЗАГРУЗКА ДАННЫХ...")
+                self.data_loader = BookDataLoader(Config.DATA_PATH)
+                self.data_loader.load_data()
+                
+                # 3. Инициализация обработчика запросов с историей
+                print("\n⚙️ ИНИЦИАЛИЗАЦИЯ ОБРАБОТЧИКА С ИСТОРИЕЙ...")
+                self.query_processor = QueryProcessor(self.data_loader)
+                self.query_processor.initialize_metrics()
+                
+                # 4. Инициализация рекомендательной системы
+                print("\n🎯 ИНИЦИАЛИЗАЦИЯ РЕКОМЕНДАТЕЛЬНОЙ СИСТЕМЫ...")
+                self.recommender = BookRecommender(
+                    self.query_processor.metrics_full,
+                    self.query_processor.metrics_filtered
+                )
+                
+                neural_success = neural_ready.result()
+                print("\n🧠 ИНИЦИАЛИЗАЦИЯ НЕЙРОСЕТИ...")
+                for line in neural_status:
+                    print(line)
+                if not neural_success:
+                    print("❌ Ошибка инициализации нейросети")
+                    return False
             
             self.initialized = True
             print("\n✅ СИСТЕМА УСПЕШНО ИНИЦИАЛИЗИРОВАНА!")
-            print("   Поддерживается история на 5 шагов назад")
+            print(f"   Поддерживается история на {Config.MAX_HISTORY_STEPS} шагов назад")
             print("   Используйте 'назад' для возврата, 'заново' для сброса")
             print("=" * 60)
             return True
@@ -103,33 +120,10 @@ class BookRecommendationSystem:
                 return result
             
             # 5. Выполнение действий в зависимости от типа запроса
-            if result["query_type"] == "recommendation":
-                recommendations = self._handle_recommendation(processed)
-                result["data"] = recommendations
-                result["message"] = processed.get("message", "")
-                
-            elif result["query_type"] == "search":  # Убрали general
-                result["data"] = processed.get("filtered_books")
-                result["message"] = processed.get("message", "")
-                
-            elif result["query_type"] == "comparison":
-                comparison_result = self._handle_comparison(processed)
-                result["data"] = comparison_result
+            handler = self._result_handlers.get(result["query_type"])
+            if handler is not None:
+                result["data"] = handler(processed)
                 result["message"] = processed.get("message", "")
-                
-            elif result["query_type"] == "step_back":
-                result["data"] = processed.get("filtered_books")
-                result["message"] = processed.get("message", "")
-                # Показываем рекомендации на основе восстановленного состояния
-                if processed.get("liked_indices"):
-                    rec_result = self._handle_recommendation(processed)
-                    if rec_result and rec_result.get("recommendations"):
-                        result["data"] = rec_result
-            
-            elif result["query_type"] == "reset":
-                result["data"] = processed.get("filtered_books")
-                result["message"] = processed.get("message", "")
-            
             else:
                 result["message"] = "Извините, я не могу ответить на ваш вопрос"
             
@@ -160,8 +154,7 @@ class BookRecommendationSystem:
                 "message": "Нет книг для рекомендаций после применения фильтров"
             }
         
-        # Обновляем метрики для текущих отфильтрованных книг
-        self.query_processor.metrics_filtered = BookDistanceMetrics(filtered_books)
+        # Метрики для текущих отфильтрованных книг уже построены обработчиком запросов
         self.recommender.metrics_filtered = self.query_processor.metrics_filtered
         
         # Получаем рекомендации на основе текущего состояния
@@ -174,9 +167,11 @@ class BookRecommendationSystem:
         )
         
         # Форматируем результат
+        rec_books = self.query_processor.get_books_info(
+            [book_idx for book_idx, _ in recommendations], is_filtered=True
+        )
         formatted_recs = []
-        for book_idx, similarity in recommendations:
-            book_info = self.query_processor.get_book_info(book_idx, is_filtered=True)
+        for book_info, (_, similarity) in zip(rec_books, recommendations):
             if book_info:
                 formatted_recs.append({
                     "book": book_info,
@@ -184,18 +179,8 @@ class BookRecommendationSystem:
                 })
         
         # Получаем информацию о лайках/дизлайках
-        liked_books = []
-        disliked_books = []
-        
-        for idx in liked_indices:
-            book_info = self.query_processor.get_book_info(idx, is_filtered=False)
-            if book_info:
-                liked_books.append(book_info)
-        
-        for idx in disliked_indices:
-            book_info = self.query_processor.get_book_info(idx, is_filtered=False)
-            if book_info:
-                disliked_books.append(book_info)
+        liked_books = [book for book in self.query_processor.get_books_info(liked_indices) if book]
+        disliked_books = [book for book in self.query_processor.get_books_info(disliked_indices) if book]
         
         return {
             "recommendations": formatted_recs,
@@ -205,16 +190,27 @@ class BookRecommendationSystem:
             "filtered_books_count": len(filtered_books)
         }
     
+    def _handle_filtered_books(self, processed_query: Dict[str, Any]) -> Any:
+        """Обработка поиска и сброса: результатом служат отфильтрованные книги"""
+        return processed_query.get("filtered_books")
+    
+    def _handle_step_back(self, processed_query: Dict[str, Any]) -> Any:
+        """Обработка шага назад: рекомендации по восстановленному состоянию, если есть лайки"""
+        if processed_query.get("liked_indices"):
+            rec_result = self._handle_recommendation(processed_query)
+            if rec_result and rec_result.get("recommendations"):
+                return rec_result
+        return processed_query.get("filtered_books")
+    
     def _handle_comparison(self, processed_query: Dict[str, Any]) -> Dict[str, Any]:
         """Обработка запроса на сравнение"""
-        comparison_books = processed_query.get("comparison_books", [])
+        comparison_indices = processed_query.get("comparison_indices", [])
         
-        if len(comparison_books) < 2:
+        if len(comparison_indices) < 2:
             return {"error": "Недостаточно книг для сравнения"}
         
-        # Находим индексы книг в полном датасете
-        book1_idx = comparison_books[0].name
-        book2_idx = comparison_books[1].name
+        # Индексы книг в полном датасете
+        book1_idx, book2_idx = comparison_indices[:2]
         
         # Сравниваем книги
         comparison_result = self.recommender.compare_books(book1_idx, book2_idx)
@@ -346,8 +342,9 @@ class BookRecommendationSystem:
         elif query_type == "search" and data is not None:
             print(f"\n🔍 РЕЗУЛЬТАТЫ ПОИСКА ({len(data)} книг):")
             if len(data) > 0:
-                for i, (_, book) in enumerate(data.head(5).iterrows(), 1):
-                    print(f"{i}. {book['title']} - {book['author']} ({book['genre']}, {book['year']} г.)")
+                # Кортежи только для показываемых строк, без Series на каждую книгу
+                for i, book in enumerate(data.head(5).itertuples(index=False), 1):
+                    print(f"{i}. {book.title} - {book.author} ({book.genre}, {book.year} г.)")
                 if len(data) > 5:
                     print(f"... и еще {len(data) - 5} книг")
         
@@ -386,7 +383,10 @@ def main():
         sys.exit(1)
     
     # Запуск интерактивного режима
-    system.interactive_mode()
+    try:
+        system.interactive_mode()
+    finally:
+        system.neural_parser.close()
 
 
 if __name__ == "__main__":
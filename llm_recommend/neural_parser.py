@@ -2,12 +2,37 @@
 Парсер запросов с использованием нейросети
 """
 import requests
+from requests.adapters import HTTPAdapter
+import hashlib
 import json
+import logging
 import re
 import time
-from typing import Dict, Any, Optional
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
 from config import Config
 
+logger = logging.getLogger(__name__)
+
+
+def _phrases_pattern(phrases):
+    """Одно регулярное выражение без учета регистра, совпадающее с любой из фраз"""
+    return re.compile('|'.join(re.escape(phrase) for phrase in phrases), re.IGNORECASE)
+
+
+# Короткие разговорные фразы, не относящиеся к книгам
+GREETING_PATTERN = _phrases_pattern(["привет", "здравствуй", "как дела", "спасибо", "пока", "до свидания"])
+
+# Декодер для извлечения JSON-объекта из текста ответа
+JSON_DECODER = json.JSONDecoder()
+
+# Текстовые команды step_back в порядке приоритета
+STEP_BACK_PATTERNS = (
+    ("1", _phrases_pattern(["начать сначала", "заново", "сбросить всё", "сбросить все", "очистить", "начни сначала"])),
+    ("-1", _phrases_pattern(["назад", "вернись назад", "отмени последнее", "шаг назад", "предыдущий"]))
+)
+
+
 class NeuralBookParser:
     def __init__(self, base_url: str = Config.NEURAL_URL):
         """
@@ -17,45 +42,76 @@ class NeuralBookParser:
         self.completion_url = f"{base_url}/api/chat"
         self.system_prompt = ""
         self.is_initialized = False
+        # Кэш ответов нейросети: хэш (модель, промпт, запрос) -> текст ответа.
+        # Ограничен Config.NEURAL_CACHE_SIZE, вытесняются давно не использованные
+        self._response_cache = OrderedDict()
+        # Одна сессия на все запросы, чтобы переиспользовать TCP-соединения
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        # Буфер сообщений инициализации (None - сообщения печатаются сразу)
+        self._status_lines = None
         
-    def initialize(self) -> bool:
+    def initialize(self, status_lines: Optional[List[str]] = None) -> bool:
         """
-        Инициализация нейросети
+        Инициализация нейросети.
+        Если передан status_lines, сообщения о ходе инициализации добавляются в него, а не печатаются
+        (инициализация в фоновом потоке не перемешивает свой вывод с выводом основного)
         """
-        print("🔍 Проверяю доступность нейросети...")
+        self._status_lines = status_lines
+        try:
+            return self._initialize()
+        finally:
+            self._status_lines = None
+    
+    def _report(self, message: str):
+        """Сообщение о ходе инициализации: в буфер status_lines или сразу на экран"""
+        if self._status_lines is not None:
+            self._status_lines.append(message)
+        else:
+            print(message)
+    
+    def _initialize(self) -> bool:
+        """Шаги инициализации нейросети"""
+        self._report("🔍 Проверяю доступность нейросети...")
         
         if not self._test_connection():
-            print("❌ Нейросеть недоступна")
+            self._report("❌ Нейросеть недоступна")
             return False
         
-        print("✅ Нейросеть доступна")
-        print("📖 Загружаю системный промпт...")
+        self._report("✅ Нейросеть доступна")
+        self._report("📖 Загружаю системный промпт...")
         
         self.system_prompt = self._load_system_prompt()
         if not self.system_prompt:
-            print("❌ Не удалось загрузить системный промпт")
+            self._report("❌ Не удалось загрузить системный промпт")
             return False
         
-        print("✅ Системный промпт загружен")
-        print("🚀 Инициализирую нейросеть...")
+        self._report("✅ Системный промпт загружен")
+        self._report("🚀 Инициализирую нейросеть...")
         
         initialization_success = self._initialize_neural_network()
         
         if initialization_success:
-            print("✅ Нейросеть успешно инициализирована")
+            self._report("✅ Нейросеть успешно инициализирована")
             self.is_initialized = True
             return True
         else:
-            print("❌ Ошибка инициализации нейросети")
+            self._report("❌ Ошибка инициализации нейросети")
             return False
     
+    def close(self):
+        """Закрытие HTTP-сессии с нейросетью"""
+        self._session.close()
+    
     def _test_connection(self) -> bool:
         """Проверка подключения к нейросети"""
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=10)
+            response = self._session.get(f"{self.base_url}/api/tags", timeout=10)
             return response.status_code == 200
         except Exception as e:
-            print(f"Ошибка подключения: {e}")
+            self._report(f"Ошибка подключения: {e}")
             return False
     
     def _load_system_prompt(self) -> str:
@@ -63,13 +119,13 @@ class NeuralBookParser:
         try:
             with open(Config.PROMPT_PATH, 'r', encoding='utf-8') as file:
                 content = file.read().strip()
-                print(f"📄 Загружен промпт длиной {len(content)} символов")
+                self._report(f"📄 Загружен промпт длиной {len(content)} символов")
                 return content
         except FileNotFoundError:
-            print(f"⚠️ Файл {Config.PROMPT_PATH} не найден")
+            self._report(f"⚠️ Файл {Config.PROMPT_PATH} не найден")
             return ""
         except Exception as e:
-            print(f"⚠️ Ошибка загрузки промпта: {e}")
+            self._report(f"⚠️ Ошибка загрузки промпта: {e}")
             return ""
     
     def _initialize_neural_network(self) -> bool:
@@ -80,10 +136,14 @@ class NeuralBookParser:
                 "messages": [
                     {"role": "user", "content": "Ответь 'READY' для подтверждения работы"}
                 ],
-                "stream": False
+                "stream": False,
+                # Тест заодно загружает модель; короткий ответ и keep_alive
+                # оставляют ее в памяти к первому запросу пользователя
+                "options": {"num_predict": 8},
+                "keep_alive": Config.NEURAL_KEEP_ALIVE
             }
             
-            response = requests.post(
+            response = self._session.post(
                 self.completion_url,
                 json=test_payload,
                 headers={"Content-Type": "application/json"},
@@ -93,14 +153,14 @@ class NeuralBookParser:
             if response.status_code == 200:
                 result = response.json()
                 content = result["message"]["content"].strip()
-                print(f"🤖 Ответ нейросети при тесте: {content}")
+                self._report(f"🤖 Ответ нейросети при тесте: {content}")
                 return True
             else:
-                print(f"❌ Ошибка теста: {response.status_code}")
+                self._report(f"❌ Ошибка теста: {response.status_code}")
                 return False
                 
         except Exception as e:
-            print(f"❌ Ошибка при тесте нейросети: {e}")
+            self._report(f"❌ Ошибка при тесте нейросети: {e}")
             return False
 
     def parse_query(self, user_query: str) -> Dict[str, Any]:
@@ -114,52 +174,77 @@ class NeuralBookParser:
         print(f"🤖 Обрабатываю запрос: '{user_query}'")
         
         try:
-            payload = {
-                "model": Config.NEURAL_MODEL,
-                "messages": [
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": user_query}
-                ],
-                "stream": False
-            }
+            cache_key = self._cache_key(user_query)
+            content = self._response_cache.get(cache_key)
             
-            start_time = time.time()
-            response = requests.post(
-                self.completion_url,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=Config.NEURAL_TIMEOUT
-            )
-            processing_time = time.time() - start_time
-            
-            if response.status_code == 200:
-                result = response.json()
-                content = result["message"]["content"].strip()
-                
-                print(f"✅ Ответ получен за {processing_time:.2f} сек")
-                
+            if content is not None:
+                print("⚡ Ответ взят из кэша")
+                self._response_cache.move_to_end(cache_key)
                 json_data = self._extract_json_from_response(content)
-                normalized_data = self._normalize_json_structure(json_data, user_query)
-                
-                # Логируем результат для отладки
-                print(f"📋 Распознанный тип: {normalized_data.get('question_type', 'неизвестно')}")
-                if normalized_data.get('step_back'):
-                    print(f"↩️  Step back: {normalized_data.get('step_back')}")
-                if normalized_data.get('feedback', {}).get('likes'):
-                    print(f"👍 Лайки: {normalized_data['feedback']['likes']}")
-                if normalized_data.get('feedback', {}).get('dislikes'):
-                    print(f"👎 Дизлайки: {normalized_data['feedback']['dislikes']}")
-                
-                return normalized_data
-                    
             else:
-                print(f"❌ Ошибка запроса к нейросети: {response.status_code}")
-                return self._get_empty_template()
+                content = self._request_completion(user_query)
+                if content is None:
+                    return self._get_empty_template()
+                json_data = self._extract_json_from_response(content)
+                # Кэшируем только ответы, из которых извлечен непустой JSON:
+                # иначе тот же запрос до вытеснения из кэша не доходил бы до нейросети
+                if isinstance(json_data, dict) and json_data and json_data != self._get_empty_template():
+                    self._response_cache[cache_key] = content
+                    if len(self._response_cache) > Config.NEURAL_CACHE_SIZE:
+                        self._response_cache.popitem(last=False)
+            
+            normalized_data = self._normalize_json_structure(json_data, user_query)
+            
+            # Логируем результат для отладки
+            logger.debug("Распознанный тип: %s", normalized_data.get('question_type', 'неизвестно'))
+            if normalized_data.get('step_back'):
+                logger.debug("Step back: %s", normalized_data.get('step_back'))
+            if normalized_data.get('feedback', {}).get('likes'):
+                logger.debug("Лайки: %s", normalized_data['feedback']['likes'])
+            if normalized_data.get('feedback', {}).get('dislikes'):
+                logger.debug("Дизлайки: %s", normalized_data['feedback']['dislikes'])
+            
+            return normalized_data
                 
         except Exception as e:
             print(f"❌ Ошибка при работе с нейросетью: {e}")
             return self._get_empty_template()
 
+    def _cache_key(self, user_query: str) -> bytes:
+        """Ключ кэша ответов по модели, системному промпту и запросу"""
+        key_source = "\x00".join((Config.NEURAL_MODEL, self.system_prompt, user_query))
+        return hashlib.blake2b(key_source.encode('utf-8'), digest_size=16).digest()
+
+    def _request_completion(self, user_query: str) -> Optional[str]:
+        """Запрос к нейросети, возвращает текст ответа или None при ошибке"""
+        payload = {
+            "model": Config.NEURAL_MODEL,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": user_query}
+            ],
+            "format": "json",
+            "stream": False,
+            "keep_alive": Config.NEURAL_KEEP_ALIVE
+        }
+        
+        start_time = time.time()
+        response = self._session.post(
+            self.completion_url,
+            json=payload,
+            headers={"Content-Type": "application/json"},
+            timeout=Config.NEURAL_TIMEOUT
+        )
+        processing_time = time.time() - start_time
+        
+        if response.status_code != 200:
+            print(f"❌ Ошибка запроса к нейросети: {response.status_code}")
+            return None
+        
+        result = response.json()
+        print(f"✅ Ответ получен за {processing_time:.2f} сек")
+        return result["message"]["content"].strip()
+
     def _extract_json_from_response(self, content: str) -> Dict[str, Any]:
         """Извлечение JSON из ответа нейросети"""
         try:
@@ -167,11 +252,12 @@ class NeuralBookParser:
             if json_match:
                 json_str = json_match.group(1)
             else:
-                json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(0)
-                else:
-                    json_str = content
+                # Разбираем первый JSON-объект за один проход, без жадного regex
+                start = content.find('{')
+                if start >= 0:
+                    parsed_data, _ = JSON_DECODER.raw_decode(content, start)
+                    return parsed_data
+                json_str = content
             
             parsed_data = json.loads(json_str)
             return parsed_data
@@ -191,11 +277,10 @@ class NeuralBookParser:
         if not isinstance(data, dict) or not data:
             # Если нет данных, проверяем нераспознанные запросы
             if user_query and len(user_query.split()) < 10:  # Короткие запросы
-                for phrase in ["привет", "здравствуй", "как дела", "спасибо", "пока", "до свидания"]:
-                    if phrase in user_query.lower():
-                        normalized["question_type"] = "other"
-                        normalized["num_question"] = "не_распознано"
-                        return normalized
+                if GREETING_PATTERN.search(user_query):
+                    normalized["question_type"] = "other"
+                    normalized["num_question"] = "не_распознано"
+                    return normalized
             return normalized
         
         # Определение типа вопроса
@@ -227,19 +312,10 @@ class NeuralBookParser:
             normalized["question_type"] = "step_back"
         else:
             # Проверяем текстовые команды для step_back
-            query_lower = user_query.lower()
-            step_back_commands = {
-                "1": ["начать сначала", "заново", "сбросить всё", "сбросить все", "очистить", "начни сначала"],
-                "-1": ["назад", "вернись назад", "отмени последнее", "шаг назад", "предыдущий"]
-            }
-            
-            for step_type, commands in step_back_commands.items():
-                for cmd in commands:
-                    if cmd in query_lower:
-                        normalized['step_back'] = step_type
-                        normalized["question_type"] = "step_back"
-                        break
-                if normalized.get('step_back'):
+            for step_type, pattern in STEP_BACK_PATTERNS:
+                if pattern.search(user_query):
+                    normalized['step_back'] = step_type
+                    normalized["question_type"] = "step_back"
                     break
         
         # Обработка нераспознанных запросов
@@ -1,17 +1,23 @@
 """
 Обработка распарсенных запросов с поддержкой истории и состояния
 """
+import json
 import pandas as pd
 import numpy as np
 from typing import Dict, Any, List, Tuple, Optional
 from data_loader import BookDataLoader
 from book_metrics import BookDistanceMetrics
-from collections import deque
+from collections import deque, OrderedDict
+from config import Config
+
+# Поля книги, которые отдаются наружу
+BOOK_INFO_COLUMNS = ['title', 'author', 'genre', 'year', 'pages', 'publisher',
+                     'language', 'age_restriction', 'has_illustrations']
 
 class QueryState:
     """Класс для хранения состояния запросов с историей"""
     
-    MAX_HISTORY_STEPS = 5  # Максимальная глубина истории
+    MAX_HISTORY_STEPS = Config.MAX_HISTORY_STEPS  # Максимальная глубина истории (шаг назад дальше невозможен)
     
     def __init__(self):
         self.reset()
@@ -76,12 +82,11 @@ class QueryState:
         for key in ['likes', 'dislikes']:
             if key in new_feedback and new_feedback[key]:
                 current_list = self.current_state['feedback'][key]
-                for item in new_feedback[key]:
-                    if item not in current_list:
-                        current_list.append(item)
+                self.current_state['feedback'][key] = list(dict.fromkeys(current_list + new_feedback[key]))
         
         # Обновляем остальные поля
-        self.current_state['filtered_books'] = filtered_books.copy() if filtered_books is not None else None
+        # DataFrame не изменяется на месте, поэтому хранится без копирования
+        self.current_state['filtered_books'] = filtered_books
         self.current_state['liked_indices'] = liked_indices.copy()
         self.current_state['disliked_indices'] = disliked_indices.copy()
         
@@ -129,13 +134,12 @@ class QueryState:
             'dislikes': state['feedback']['dislikes'].copy()
         }
         
-        # Копируем DataFrame если он есть
-        filtered_books_copy = state['filtered_books'].copy() if state['filtered_books'] is not None else None
-        
+        # DataFrame с отфильтрованными книгами нигде не изменяется на месте,
+        # поэтому состояния в истории разделяют его без копирования
         return {
             'filter': filter_copy,
             'feedback': feedback_copy,
-            'filtered_books': filtered_books_copy,
+            'filtered_books': state['filtered_books'],
             'liked_indices': state['liked_indices'].copy(),
             'disliked_indices': state['disliked_indices'].copy()
         }
@@ -159,14 +163,19 @@ class QueryProcessor:
         self.state = QueryState()
         self.metrics_full = None
         self.metrics_filtered = None
+        # Кэш результатов фильтрации: канонический JSON критериев -> позиции книг
+        self._filter_cache = OrderedDict()
         
     def initialize_metrics(self):
         """Инициализация метрик для данных"""
         if self.data_loader.df is not None:
+            # Данные загружены заново - прежние результаты фильтрации недействительны
+            self._filter_cache.clear()
             self.metrics_full = BookDistanceMetrics(self.data_loader.df)
             # Инициализируем filtered_books как полный датасет
-            self.state.current_state['filtered_books'] = self.data_loader.df.copy()
-            self.metrics_filtered = BookDistanceMetrics(self.state.current_state['filtered_books'])
+            self.state.current_state['filtered_books'] = self.data_loader.df
+            # Без фильтров метрики совпадают с полными - не строим их повторно
+            self.metrics_filtered = self.metrics_full
     
     def process_query(self, parsed_query: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -182,7 +191,7 @@ class QueryProcessor:
             'filtered_books': None,
             'liked_indices': [],
             'disliked_indices': [],
-            'comparison_books': [],
+            'comparison_indices': [],
             'message': '',
             'history_info': self.state.get_history_info(),
             'step_back_type': parsed_query.get('step_back', '')
@@ -229,7 +238,7 @@ class QueryProcessor:
             
             # Обновляем метрики для отфильтрованных данных
             if result['filtered_books'] is not None and len(result['filtered_books']) > 0:
-                self.metrics_filtered = BookDistanceMetrics(result['filtered_books'])
+                self.metrics_filtered = self._metrics_for(result['filtered_books'])
         
         # Обработка лайков/дизлайков
         if query_type == 'recommendation' or 'feedback' in parsed_query:
@@ -244,9 +253,9 @@ class QueryProcessor:
             new_liked_indices = self.data_loader.get_book_indices_by_titles(new_likes)
             new_disliked_indices = self.data_loader.get_book_indices_by_titles(new_dislikes)
             
-            # Объединяем с текущими
-            combined_liked_indices = list(set(current_state['liked_indices'] + new_liked_indices))
-            combined_disliked_indices = list(set(current_state['disliked_indices'] + new_disliked_indices))
+            # Объединяем с текущими без повторов, сохраняя порядок добавления
+            combined_liked_indices = list(dict.fromkeys(current_state['liked_indices'] + new_liked_indices))
+            combined_disliked_indices = list(dict.fromkeys(current_state['disliked_indices'] + new_disliked_indices))
             
             result['liked_indices'] = combined_liked_indices
             result['disliked_indices'] = combined_disliked_indices
@@ -277,16 +286,10 @@ class QueryProcessor:
             title1 = compare.get('title1', '')
             title2 = compare.get('title2', '')
             
-            # Ищем книги только по названиям
-            book1 = self.data_loader.get_book_by_title_author(title1, None)
-            book2 = self.data_loader.get_book_by_title_author(title2, None)
+            # Ищем книги только по названиям, сразу получая их индексы
+            result['comparison_indices'] = self.data_loader.get_book_indices_by_titles([title1, title2])
             
-            if book1 is not None:
-                result['comparison_books'].append(book1)
-            if book2 is not None:
-                result['comparison_books'].append(book2)
-            
-            if len(result['comparison_books']) < 2:
+            if len(result['comparison_indices']) < 2:
                 result['message'] += "\n⚠️ Не найдены книги для сравнения"
         
         return result
@@ -306,12 +309,13 @@ class QueryProcessor:
         # Для команды "начать сначала" сбрасываем фильтры в data_loader
         if step_type == "1":
             self.data_loader.reset_filters()
-            self.metrics_filtered = BookDistanceMetrics(self.data_loader.df)
+            # Без фильтров используем уже построенные метрики полного датасета
+            self.metrics_filtered = self.metrics_full
             message = '🔄 Начинаем заново. Все фильтры и предпочтения сброшены.'
         else:
             # Обновляем метрики для восстановленного состояния
             if previous_state['filtered_books'] is not None:
-                self.metrics_filtered = BookDistanceMetrics(previous_state['filtered_books'])
+                self.metrics_filtered = self._metrics_for(previous_state['filtered_books'])
             message = '↩️  Возврат на шаг назад'
         
         return {
@@ -324,6 +328,30 @@ class QueryProcessor:
             'history_info': self.state.get_history_info()
         }
     
+    def _metrics_for(self, books: pd.DataFrame) -> BookDistanceMetrics:
+        """Метрики для набора книг: уже построенные для того же DataFrame используются повторно"""
+        for metrics in (self.metrics_filtered, self.metrics_full):
+            if metrics is not None and metrics.df is books:
+                return metrics
+        return BookDistanceMetrics(books)
+    
+    def _filter_books_cached(self, filter_criteria: Dict[str, Any]) -> pd.DataFrame:
+        """Фильтрация через data_loader с кэшем позиций книг по каноническому виду критериев"""
+        key = json.dumps(filter_criteria, sort_keys=True, ensure_ascii=False, default=str)
+        
+        positions = self._filter_cache.get(key)
+        if positions is not None:
+            self._filter_cache.move_to_end(key)
+        else:
+            positions = self.data_loader.filter_positions(filter_criteria)
+            positions.setflags(write=False)
+            self._filter_cache[key] = positions
+            if len(self._filter_cache) > Config.FILTER_CACHE_SIZE:
+                self._filter_cache.popitem(last=False)
+        
+        # Срез книг всегда через data_loader: его состояние и вывод одинаковы при попадании и промахе
+        return self.data_loader.take_books(positions)
+    
     def _handle_reset(self) -> Dict[str, Any]:
         """Обработка команды 'заново' через other"""
         # Используем step_back с типом "1" для начала сначала
@@ -423,7 +451,7 @@ class QueryProcessor:
         
         # Применяем фильтры
         try:
-            filtered_books = self.data_loader.filter_books(filter_criteria)
+            filtered_books = self._filter_books_cached(filter_criteria)
             result['filtered_books'] = filtered_books
             
             # Формируем информативное сообщение
@@ -480,23 +508,27 @@ class QueryProcessor:
     
     def get_book_info(self, book_idx: int, is_filtered: bool = False) -> Dict[str, Any]:
         """Получение информации о книге"""
+        return self.get_books_info([book_idx], is_filtered)[0]
+    
+    def get_books_info(self, book_indices: List[int], is_filtered: bool = False) -> List[Optional[Dict[str, Any]]]:
+        """
+        Получение информации о нескольких книгах одной выборкой из DataFrame
+        
+        Returns:
+            Список словарей в порядке book_indices (None для отсутствующих книг)
+        """
         if is_filtered and self.state.current_state['filtered_books'] is not None:
             df = self.state.current_state['filtered_books']
         else:
             df = self.data_loader.df
         
-        if df is None or book_idx >= len(df):
-            return None
+        if df is None:
+            return [None] * len(book_indices)
         
-        book = df.iloc[book_idx]
-        return {
-            'title': book['title'],
-            'author': book['author'],
-            'genre': book['genre'],
-            'year': book['year'],
-            'pages': book['pages'],
-            'publisher': book['publisher'],
-            'language': book['language'],
-            'age_restriction': book['age_restriction'],
-            'has_illustrations': 'Есть' if book['has_illustrations'] == 1 else 'Нет'
-        }
\ No newline at end of file
+        positions = [idx for idx in book_indices if idx < len(df)]
+        records = df.iloc[positions][BOOK_INFO_COLUMNS].to_dict(orient='records')
+        for record in records:
+            record['has_illustrations'] = 'Есть' if record['has_illustrations'] == 1 else 'Нет'
+        
+        by_position = dict(zip(positions, records))
+        return [by_position.get(idx) for idx in book_indices]